@@ -30,8 +30,15 @@
 # The code here was written by Simon Parsons, based on examples from
 # the PacMan AI projects.
 
-from random import random
+from array import array
+from collections import namedtuple
+from random import Random, random
 from pacman import Directions
+import hashlib
+import os
+import sys
+import threading
+import types
 import util
 
 #
@@ -58,23 +65,111 @@ nonDeterministic = True
 # Probability that Pacman carries out the intended action:
 directionProb = 0.8
 
+# How many uniform samples a NoiseSource draws at a time.
+noiseBlockSize = 1024
+
+# All-pairs maze distances (see mazeDistance).
+#
+# If persistMazeDistances is True, the table for each layout is saved
+# in mazeDistanceDir the first time it is built and loaded from there
+# afterwards.
+persistMazeDistances = False
+mazeDistanceDir = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "layouts", "compiled"
+)
+
+# Marks unreachable pairs in the maze distance table.
+_UNREACHABLE = 0xFFFF
+_MAZE_DISTANCE_VERSION = 1
+
+# Unit steps of the four compass directions.
+_RAY_DIRECTIONS = {
+    Directions.NORTH: (0, 1),
+    Directions.SOUTH: (0, -1),
+    Directions.EAST: (1, 0),
+    Directions.WEST: (-1, 0),
+}
+
+
+# The last observation made by observe() in each thread, with the state it
+# was made from, so games played in parallel threads do not share it.
+_lastObservation = threading.local()
+
 
 #
 # Sensing
 #
 
 
+# Everything Pacman senses in one turn. See observe().
+Observation = namedtuple(
+    "Observation",
+    ["pacman", "legal_actions", "food", "capsules", "ghosts", "ghost_states", "ghost_timers"],
+)
+
+
+def observe(state):
+    """
+    Restituisce in un solo passaggio tutto ciò che Pacman percepisce nello
+    stato: la visibilità viene calcolata una volta sola per cibo, capsule e
+    fantasmi. L'osservazione dell'ultimo stato viene memorizzata, quindi le
+    funzioni get_food, get_ghosts, whereAmI, ... chiamate sullo stesso stato
+    non rileggono lo stato.
+
+    Args:
+        state: Lo stato attuale del gioco.
+
+    Returns:
+        (Observation): Tupla immutabile con posizione di Pacman, azioni
+        legali, cibo, capsule e fantasmi visibili, e stato dei fantasmi (come
+        ghost_states e ghostStatesWithTimes).
+    """
+    last = getattr(_lastObservation, "memo", None)
+    if last is not None and last[0] is state:
+        return last[1]
+
+    cells = _visibleCells(state)
+    ghost_positions = state.getGhostPositions()
+    ghosts = union(
+        _filterVisible(ghost_positions, cells),
+        audible(ghost_positions, state),
+    )
+    ghost_states = state.getGhostStates()
+    observation = Observation(
+        pacman=state.getPacmanPosition(),
+        legal_actions=tuple(state.getLegalPacmanActions()),
+        food=tuple(_filterVisible(state.getFood().asList(), cells)),
+        capsules=tuple(_filterVisible(state.getCapsules(), cells)),
+        ghosts=tuple((int(x), int(y)) for x, y in ghosts),
+        ghost_states=tuple((s.getPosition(), int(s.scaredTimer > 0)) for s in ghost_states),
+        ghost_timers=tuple((s.getPosition(), s.scaredTimer) for s in ghost_states),
+    )
+    _lastObservation.memo = (state, observation)
+    return observation
+
+
 def manhattanDistance(agent, ghost):
     return util.manhattanDistance(agent, ghost)
 
 
+def mazeDistance(a, b, state):
+    # Returns the length of the shortest path between a and b through
+    # the maze, or None if there is no path (or either is not a floor
+    # cell).
+    #
+    # The distances come from a table computed once per layout, so
+    # each call is a few dictionary lookups, whatever the size of the
+    # board.
+    return get_geometry(state).maze_distance(a, b)
+
+
 def whereAmI(state):
     # Returns an (x, y) pair of Pacman's position.
     #
     # This version says exactly where Pacman is.
     # In later version this may be obfusticated.
 
-    return state.getPacmanPosition()
+    return observe(state).pacman
 
 
 def legalActions(state):
@@ -83,16 +178,12 @@ def legalActions(state):
     # Just pulls this data out of the state. Function included so that
     # all interactions are through this API.
 
-    return state.getLegalPacmanActions()
+    return list(observe(state).legal_actions)
 
 
 def get_ghosts(state):
     # Returns a list of (x, y) pairs of ghost positions with integer coordinates.
-    ghost_positions = union(
-        visible(state.getGhostPositions(), state),
-        audible(state.getGhostPositions(), state),
-    )
-    return [(int(x), int(y)) for x, y in ghost_positions]
+    return list(observe(state).ghosts)
 
 
 def calculate_ghost_and_danger_zone_rewards(state, ghost_reward, danger_zone_reward):
@@ -103,7 +194,7 @@ def calculate_ghost_and_danger_zone_rewards(state, ghost_reward, danger_zone_rew
 
 
 def ghost_states(state):
-    return [(s.getPosition(), int(s.scaredTimer > 0)) for s in state.getGhostStates()]
+    return list(observe(state).ghost_states)
 
 
 def ghostStatesWithTimes(state):
@@ -111,11 +202,7 @@ def ghostStatesWithTimes(state):
     # mode, "state" is a time value (how much longer the ghost will
     # remain scared/edible) rather than 1.
 
-    ghostStateInfo = state.getGhostStates()
-    ghostStates = []
-    for s in ghostStateInfo:
-        ghostStates.append((s.getPosition(), s.scaredTimer))
-    return ghostStates
+    return list(observe(state).ghost_timers)
 
 
 def get_capsules(state):
@@ -133,7 +220,7 @@ def get_capsules(state):
     # 2) Pacman is not moving, and the capsule is within the visibilityLimit.
     #
     # In both cases, walls block the view.
-    return visible(state.getCapsules(), state)
+    return list(observe(state).capsules)
 
 
 def get_blank(food, ghosts, capsules, walls, rewards):
@@ -158,22 +245,11 @@ def get_food(state):
     #
     # In both cases, walls block the view.
 
-    food_positions = [
-        (x, y)
-        for x in range(state.getFood().width)
-        for y in range(state.getFood().height)
-        if state.getFood()[x][y]
-    ]
-    return visible(food_positions, state)
+    return list(observe(state).food)
 
 
 def get_walls(state):
-    return [
-        (x, y)
-        for x in range(state.getWalls().width)
-        for y in range(state.getWalls().height)
-        if state.getWalls()[x][y]
-    ]
+    return list(get_geometry(state).walls)
 
 
 def get_corners(state):
@@ -186,14 +262,11 @@ def get_corners(state):
     Returns:
         Una lista di tuple contenenti le coordinate degli angoli.
     """
-
-    width, height = state.getWalls().width, state.getWalls().height
-    return [(0, 0), (width - 1, 0), (0, height - 1), (width - 1, height - 1)]
+    return list(get_geometry(state).corners)
 
 
 def get_inner_corners(state):
-    width, height = state.getWalls().width - 2, state.getWalls().height - 2
-    return [(1, 1), (width, 1), (1, height), (width, height)]
+    return list(get_geometry(state).inner_corners)
 
 
 def get_map_dimensions(state):
@@ -206,44 +279,318 @@ def get_map_dimensions(state):
     Returns:
         Una tupla contenente la larghezza e l'altezza della mappa.
     """
-    return state.getWalls().width, state.getWalls().height
+    return get_geometry(state).dimensions
+
+
+def get_layout_text(state):
+    """
+    Restituisce il testo del layout, utile come chiave per le cache per layout.
+
+    Args:
+        state: Lo stato attuale del gioco.
+
+    Returns:
+        Il testo del layout, una riga per ogni riga della mappa.
+    """
+    return "\n".join(state.data.layout.layoutText)
 
 
 def get_adjacency_list(floors):
+    # Builds a new adjacency list for any list of floors. For the floors of
+    # the current layout, get_adjacency returns the one already built.
     adj_list = {}
-    directions = {
-        Directions.NORTH: (0, 1),
-        Directions.SOUTH: (0, -1),
-        Directions.EAST: (1, 0),
-        Directions.WEST: (-1, 0),
-    }
     for floor in floors:
         adj_list[floor] = {}
         x, y = floor
-        for direction, (dx, dy) in directions.items():
+        for direction, (dx, dy) in _RAY_DIRECTIONS.items():
             adj_list[floor][direction] = (x + dx, y + dy)
     return adj_list
 
 
+def get_adjacency(state):
+    # The adjacency list of the layout's floors, built once per layout. It is
+    # shared, so it is read-only.
+    return get_geometry(state).adjacency
+
+
 def get_floors(state):
-    walls = set(get_walls(state))
+    return list(get_geometry(state).floors)
 
-    x, y = zip(*walls)
-    x_min, x_max = min(x), max(x)
-    y_min, y_max = min(y), max(y)
 
-    return [
-        (x, y)
-        for x in range(x_min, x_max + 1)
-        for y in range(y_min, y_max + 1)
-        if (x, y) not in walls
-    ]
+def get_geometry(state):
+    """
+    Restituisce la geometria statica del layout, costruita una sola volta.
+
+    I muri non cambiano durante la partita, quindi muri, pavimenti, angoli,
+    dimensioni e adiacenze vengono calcolati alla prima richiesta e conservati
+    nella cache della griglia dei muri (Grid.getCached), condivisa da tutti
+    gli stati della partita: le richieste successive costano O(1).
+
+    Args:
+        state: Lo stato attuale del gioco.
+
+    Returns:
+        (LayoutGeometry): La geometria del layout.
+    """
+    return state.getWalls().getCached("geometry", LayoutGeometry)
+
+
+class LayoutGeometry:
+    """
+    Geometria statica di un layout. Gli attributi sono condivisi tra tutti gli
+    agenti e non vanno modificati: le funzioni del modulo ne restituiscono
+    copie.
+
+    Attributes:
+        dimensions (tuple): Larghezza e altezza della mappa.
+        wall_bits (int): Bitset dei muri; il bit x * altezza + y indica la cella (x, y).
+        walls (tuple): Le celle occupate dai muri, per colonne.
+        floors (tuple): Le celle calpestabili, per colonne.
+        floor_index (dict): Cella calpestabile -> posizione in floors.
+        adjacency (mappingproxy): Cella calpestabile -> {direzione: cella
+            adiacente}, in sola lettura.
+        corners (tuple): Gli angoli della mappa.
+        inner_corners (tuple): Gli angoli interni al bordo di muri.
+    """
+
+    def __init__(self, wall_grid):
+        """
+        Args:
+            wall_grid (Grid): La griglia dei muri del layout.
+        """
+        width, height = wall_grid.width, wall_grid.height
+        self.dimensions = (width, height)
+
+        walls = []
+        wall_bits = 0
+        for x in range(width):
+            for y in range(height):
+                if wall_grid[x][y]:
+                    walls.append((x, y))
+                    wall_bits |= 1 << (x * height + y)
+        self.walls = tuple(walls)
+        self.wall_bits = wall_bits
+
+        # Pavimenti: le celle senza muro nel rettangolo che contiene i muri
+        # (l'intera mappa se non ci sono muri)
+        wall_set = set(walls)
+        x_values, y_values = zip(*walls) if walls else ((0, width - 1), (0, height - 1))
+        self.floors = tuple(
+            (x, y)
+            for x in range(min(x_values), max(x_values) + 1)
+            for y in range(min(y_values), max(y_values) + 1)
+            if (x, y) not in wall_set
+        )
+        self.floor_index = {floor: i for i, floor in enumerate(self.floors)}
+        self.adjacency = types.MappingProxyType(
+            {
+                floor: types.MappingProxyType(neighbours)
+                for floor, neighbours in get_adjacency_list(self.floors).items()
+            }
+        )
+
+        self.corners = ((0, 0), (width - 1, 0), (0, height - 1), (width - 1, height - 1))
+        self.inner_corners = (
+            (1, 1),
+            (width - 2, 1),
+            (1, height - 2),
+            (width - 2, height - 2),
+        )
+
+        self.wall_grid = wall_grid
+        self._rays = None
+        self._distance_fields = {}
+        self._maze_distances = None
+
+    def is_wall(self, position):
+        """
+        Indica se la cella (con coordinate intere) è un muro; le celle fuori
+        dalla mappa sono considerate muri.
+        """
+        x, y = position
+        width, height = self.dimensions
+        if not (0 <= x < width and 0 <= y < height):
+            return True
+        return bool(self.wall_bits >> (x * height + y) & 1)
+
+    def distance_field(self, source, limit):
+        """
+        Restituisce le distanze nel labirinto da source, fino a limit passi,
+        calcolate con una BFS sul grafo dei pavimenti. Il risultato viene
+        memorizzato, così le chiamate successive con la stessa cella sono
+        gratuite.
+
+        Args:
+            source (tuple): La cella di partenza.
+            limit (int): La distanza massima.
+
+        Returns:
+            (dict): Cella -> distanza, per le celle entro limit passi
+            (source compresa).
+        """
+        key = (source, limit)
+        field = self._distance_fields.get(key)
+        if field is None:
+            field = {source: 0}
+            frontier = [source]
+            for distance in range(1, limit + 1):
+                next_frontier = []
+                for cell in frontier:
+                    for neighbour in self.adjacency.get(cell, {}).values():
+                        if neighbour in self.floor_index and neighbour not in field:
+                            field[neighbour] = distance
+                            next_frontier.append(neighbour)
+                frontier = next_frontier
+            self._distance_fields[key] = field
+        return field
+
+    def maze_distance(self, a, b):
+        """
+        Restituisce la distanza nel labirinto tra due celle.
+
+        Args:
+            a (tuple): La prima cella.
+            b (tuple): La seconda cella.
+
+        Returns:
+            (int): Il numero di passi del cammino minimo; None se non esiste o
+            se una delle due celle non è calpestabile.
+        """
+        # Le posizioni intere (anche come float, es. (1.0, 2.0)) si trovano
+        # direttamente; le altre vengono troncate come nel resto del modulo
+        floor_index = self.floor_index
+        i = floor_index.get(a)
+        if i is None:
+            i = floor_index.get((int(a[0]), int(a[1])))
+        j = floor_index.get(b)
+        if j is None:
+            j = floor_index.get((int(b[0]), int(b[1])))
+        if i is None or j is None:
+            return None
+        table = self._maze_distances
+        if table is None:
+            table = self.maze_distances()
+        distance = table[i * len(self.floors) + j]
+        return None if distance == _UNREACHABLE else distance
+
+    def maze_distances(self):
+        """
+        Restituisce la tabella delle distanze tra tutte le coppie di
+        pavimenti, calcolata alla prima richiesta con una BFS da ogni cella
+        (o caricata da disco se persistMazeDistances).
+
+        Returns:
+            (array): Array 'H' di len(floors) ** 2 elementi; la distanza tra
+            floors[i] e floors[j] è in posizione i * len(floors) + j.
+        """
+        if self._maze_distances is None:
+            path = self._maze_distance_path()
+            table = _load_maze_distances(path, len(self.floors) ** 2)
+            if table is None:
+                table = self._build_maze_distances()
+                if persistMazeDistances:
+                    _save_maze_distances(table, path)
+            self._maze_distances = table
+        return self._maze_distances
+
+    def _build_maze_distances(self):
+        n = len(self.floors)
+        neighbours = [
+            [
+                self.floor_index[cell]
+                for cell in self.adjacency[floor].values()
+                if cell in self.floor_index
+            ]
+            for floor in self.floors
+        ]
+        table = array("H", [_UNREACHABLE]) * (n * n)
+        for source in range(n):
+            row = source * n
+            table[row + source] = 0
+            frontier = [source]
+            distance = 0
+            while frontier:
+                distance += 1
+                next_frontier = []
+                for cell in frontier:
+                    for neighbour in neighbours[cell]:
+                        if table[row + neighbour] == _UNREACHABLE:
+                            table[row + neighbour] = distance
+                            next_frontier.append(neighbour)
+                frontier = next_frontier
+        return table
+
+    def _maze_distance_path(self):
+        if not persistMazeDistances:
+            return None
+        # The file is raw machine words, so the word layout is in the key
+        key = "%d\n%d\n%s\n%r\n%r" % (
+            _MAZE_DISTANCE_VERSION,
+            array("H").itemsize,
+            sys.byteorder,
+            self.dimensions,
+            self.walls,
+        )
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        return os.path.join(mazeDistanceDir, digest + ".dist")
+
+    def ray_table(self):
+        """
+        Restituisce la tabella di visibilità (vedi get_ray_table), costruita
+        alla prima richiesta.
+        """
+        if self._rays is None:
+            width, height = self.dimensions
+            self._rays = {
+                (x, y): {
+                    direction: _castRay((x, y), direction, self.wall_grid)
+                    for direction in _RAY_DIRECTIONS
+                }
+                for x in range(width)
+                for y in range(height)
+                if not self.wall_grid[x][y]
+            }
+        return self._rays
 
 
 #
 # Acting
 #
-def makeMove(direction, legal):
+class NoiseSource:
+    """
+    Sorgente di numeri casuali per il modello di movimento non
+    deterministico di una partita.
+
+    Il generatore è indipendente dal modulo random, quindi gli scivolamenti
+    di una partita dipendono solo dal seme e dall'indice della partita, e
+    partite giocate in parallelo non condividono lo stato del generatore. I
+    campioni uniformi vengono estratti a blocchi di noiseBlockSize.
+    """
+
+    def __init__(self, seed, game_index=0):
+        """
+        Args:
+            seed: Il seme (un intero o una stringa).
+            game_index (int): L'indice della partita, combinato con il seme.
+        """
+        self.generator = Random("%s/%d" % (seed, game_index))
+        self.samples = array("d")
+        self.next_sample = 0
+
+    def random(self):
+        """
+        Restituisce il prossimo campione uniforme in [0, 1).
+        """
+        if self.next_sample == len(self.samples):
+            draw = self.generator.random
+            self.samples = array("d", [draw() for _ in range(noiseBlockSize)])
+            self.next_sample = 0
+        sample = self.samples[self.next_sample]
+        self.next_sample += 1
+        return sample
+
+
+def makeMove(direction, legal, noise=None):
     # This version implements non-deterministic movement.
     #
     # Paacman has a probability of directionProb of moving in the
@@ -254,6 +601,9 @@ def makeMove(direction, legal):
     #
     # With the default setting of directionProb = 0.8, this is exactly
     # the motion model we studied in the MDP lecture.
+    #
+    # If noise (a NoiseSource) is given, the samples come from it
+    # rather than from the global random number generator.
 
     # If Pacman hasn't yet moved, then non-determinism plays no role in
     # deciding what Pacman does:
@@ -265,7 +615,7 @@ def makeMove(direction, legal):
         # direction with probability directionProb.
         #
         # Otherwise make a different move.
-        sample = random()
+        sample = noise.random() if noise is not None else random()
         if sample <= directionProb:
             # Here the non-deterministic action selection says to
             # return the original move, but we need to check it is
@@ -279,7 +629,7 @@ def makeMove(direction, legal):
             else:
                 return Directions.STOP
         else:
-            return selectNewMove(direction, legal)
+            return selectNewMove(direction, legal, noise)
     else:
         # When actions are deterministic, Pacman moves in the
         # specified direction
@@ -309,80 +659,105 @@ def get_danger_zones(state, pacman, ghosts, map_width, map_height, safety_distan
     # Returns a list of unique (x, y) pairs of positions that are within
     # "safe_distance" of any ghost, but only if Pacman is also within
     # "safe_distance" of the ghost.
-
+    #
+    # Distances are measured through the maze, so walls block the
+    # danger zone, and the distance fields around each ghost cell are
+    # cached. map_width and map_height are no longer needed, since the
+    # fields only contain cells of the map; they are kept so that
+    # existing callers still work.
+
+    geometry = get_geometry(state)
+    pacman = (int(pacman[0]), int(pacman[1]))
     danger_zone = set()
 
     for ghost in ghosts:
-        if manhattanDistance(pacman, ghost) > safety_distance:
+        field = geometry.distance_field((int(ghost[0]), int(ghost[1])), safety_distance)
+        if pacman not in field:
             # Skip this ghost if Pacman is not within safe_distance
             continue
-
-        for dx in range(-safety_distance, safety_distance + 1):
-            for dy in range(-safety_distance, safety_distance + 1):
-                x, y = int(ghost[0] + dx), int(ghost[1] + dy)
-                if 0 <= x < map_width and 0 <= y < map_height:
-                    danger_zone.add((x, y))
+        danger_zone.update(field)
 
     return list(danger_zone)
 
 
-def inFront(object, facing, state):
-    # Returns true if the object is along the corridor in the
-    # direction of the parameter "facing" before a wall gets in the
-    # way.
+def _load_maze_distances(path, size):
+    # Loads a maze distance table saved by _save_maze_distances. Returns
+    # None if there is no file, or it does not have the expected size.
+    if path is None:
+        return None
+    table = array("H")
+    try:
+        with open(path, "rb") as f:
+            table.frombytes(f.read())
+    except OSError:
+        return None
+    return table if len(table) == size else None
+
+
+def _save_maze_distances(table, path):
+    # Write errors are ignored: the file is only a cache. The rename
+    # makes sure that other processes never read a partial file.
+    temp_path = "%s.%d.tmp" % (path, os.getpid())
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(temp_path, "wb") as f:
+            f.write(table.tobytes())
+        os.replace(temp_path, path)
+    except OSError:
+        pass
+
+
+def get_ray_table(state):
+    """
+    Restituisce la tabella di visibilità del layout, costruita una sola volta.
 
-    pacman = state.getPacmanPosition()
-    pacman_x = pacman[0]
-    pacman_y = pacman[1]
-    wallList = get_walls(state)
+    Per ogni cella calpestabile e per ogni direzione, la tabella contiene la
+    tupla ordinata delle celle che si vedono guardando in quella direzione
+    prima che un muro blocchi la vista.
 
-    # If Pacman is facing North
-    if facing == Directions.NORTH:
-        # Check if the object is anywhere due North of Pacman before a
-        # wall intervenes.
-        next = (pacman_x, pacman_y + 1)
-        while not next in wallList:
-            if next == object:
-                return True
-            else:
-                next = (pacman_x, next[1] + 1)
-        return False
+    Args:
+        state: Lo stato attuale del gioco.
 
-    # If Pacman is facing South
-    if facing == Directions.SOUTH:
-        # Check if the object is anywhere due North of Pacman before a
-        # wall intervenes.
-        next = (pacman_x, pacman_y - 1)
-        while not next in wallList:
-            if next == object:
-                return True
-            else:
-                next = (pacman_x, next[1] - 1)
-        return False
+    Returns:
+        Un dizionario cella -> {direzione: tupla di celle}.
+    """
+    return get_geometry(state).ray_table()
 
-    # If Pacman is facing East
-    if facing == Directions.EAST:
-        # Check if the object is anywhere due East of Pacman before a
-        # wall intervenes.
-        next = (pacman_x + 1, pacman_y)
-        while not next in wallList:
-            if next == object:
-                return True
-            else:
-                next = (next[0] + 1, pacman_y)
-        return False
 
-    # If Pacman is facing West
-    if facing == Directions.WEST:
-        # Check if the object is anywhere due West of Pacman before a
-        # wall intervenes.
-        next = (pacman_x - 1, pacman_y)
-        while not next in wallList:
-            if next == object:
-                return True
-            else:
-                next = (next[0] - 1, pacman_y)
-        return False
+def _castRay(position, facing, walls):
+    # The cells along the corridor in the direction "facing", in order,
+    # up to the first wall (or the edge of the map).
+    dx, dy = _RAY_DIRECTIONS[facing]
+    x, y = int(position[0]) + dx, int(position[1]) + dy
+    cells = []
+    while 0 <= x < walls.width and 0 <= y < walls.height and not walls[x][y]:
+        cells.append((x, y))
+        x, y = x + dx, y + dy
+    return tuple(cells)
+
+
+def _rays(state):
+    # The rays from Pacman's position, from the cached table when Pacman
+    # is on a grid point.
+    pacman = state.getPacmanPosition()
+    rays = get_ray_table(state).get(pacman)
+    if rays is None:
+        walls = state.getWalls()
+        rays = {d: _castRay(pacman, d, walls) for d in _RAY_DIRECTIONS}
+    return rays
+
+
+def inFront(object, facing, state):
+    # Returns true if the object is along the corridor in the
+    # direction of the parameter "facing" before a wall gets in the
+    # way.
+    #
+    # The corridor is looked up in the precomputed ray table rather
+    # than walked cell by cell.
+
+    if facing not in _RAY_DIRECTIONS:
+        return None
+    return object in _rays(state)[facing]
 
 
 def atSide(object, facing, state):
@@ -425,12 +800,35 @@ def atSide(object, facing, state):
 def visible(objects, state):
     # When passed a list of objects, returns those that are visible to
     # Pacman.
+    return _filterVisible(objects, _visibleCells(state))
+
+
+def _filterVisible(objects, cells):
+    # Applies the result of _visibleCells to a list of objects: those
+    # in front come first, then those to the side.
+    if cells is None:
+        return objects
+    front, side = cells
+    return [o for o in objects if o in front] + [o for o in objects if o in side]
+
+
+def _visibleCells(state):
+    # Returns the sets of cells that Pacman can see in front and to the
+    # side, so that several lists of objects can be filtered with one
+    # computation.
+
+    # If we return None, we have full observability, and there is no
+    # need to work out what Pacman can see.
+    if not partialVisibility:
+        return None
 
     # This code creates partial observability by only returning some
     # of the members of objects.
+    #
+    # Along a corridor the Manhattan distance to Pacman is the position
+    # in the ray, so the distance limits are slices of the rays.
     facing = state.getPacmanState().configuration.direction
-    visibleObjects = []
-    sideObjects = []
+    rays = _rays(state)
 
     if facing != Directions.STOP:
 
@@ -438,19 +836,13 @@ def visible(objects, state):
         # and to the side (if there are any side corridors).
 
         # Objects in front. Visible up to "visibilityLimit"
-        for i in range(len(objects)):
-            if inFront(objects[i], facing, state):
-                visibleObjects.append(objects[i])
-        visibleObjects = distanceLimited(visibleObjects, state, visibilityLimit)
+        front = set(rays[facing][:visibilityLimit])
 
         # Objects to the side. Visible up to "sideLimit"
-        for i in range(len(objects)):
-            if atSide(objects[i], facing, state):
-                sideObjects.append(objects[i])
-        sideObjects = distanceLimited(sideObjects, state, sideLimit)
+        side = set(rays[Directions.LEFT[facing]][:sideLimit])
+        side.update(rays[Directions.RIGHT[facing]][:sideLimit])
 
-        # Combine lists.
-        visibleObjects = visibleObjects + sideObjects
+        return front, side
 
     else:
 
@@ -460,23 +852,10 @@ def visible(objects, state):
         # after the first move is made, so this code will not run
         # after the first move :-(
 
-        for i in range(len(objects)):
-            if inFront(objects[i], Directions.NORTH, state):
-                visibleObjects.append(objects[i])
-            if inFront(objects[i], Directions.SOUTH, state):
-                visibleObjects.append(objects[i])
-            if inFront(objects[i], Directions.EAST, state):
-                visibleObjects.append(objects[i])
-            if inFront(objects[i], Directions.WEST, state):
-                visibleObjects.append(objects[i])
-        visibleObjects = distanceLimited(visibleObjects, state, visibilityLimit)
-
-    # If we return visibleObjects, we have partial observability. If
-    # we return objects, then we have full observability.
-    if partialVisibility:
-        return visibleObjects
-    else:
-        return objects
+        around = set()
+        for direction in _RAY_DIRECTIONS:
+            around.update(rays[direction][:visibilityLimit])
+        return around, set()
 
 
 def audible(ghosts, state):
@@ -494,13 +873,13 @@ def union(a, b):
     return list(set(a) | set(b))
 
 
-def selectNewMove(direction, legal):
+def selectNewMove(direction, legal, noise=None):
     # This function is called if Pacman isn't moving in the specified
     # direction. Need to pick another legal action.
 
     # Pick with 50% probability between the two perpendicular
     # possibilities.
-    sample = random()
+    sample = noise.random() if noise is not None else random()
     if sample <= 0.5:
         left = True
     else:
@@ -0,0 +1,65 @@
+import random
+import sys
+import time
+from optparse import OptionParser
+
+import ghostAgents
+import layout
+import pacman
+import textDisplay
+import util
+from game import Agent
+
+# Misura il costo del ciclo di gioco (Game.run) su molte partite silenziose,
+# come quelle eseguite con -q. Esempio:
+#
+#   python benchmark_games.py -l smallClassic -n 2000
+#
+# Pacman e i fantasmi scelgono mosse casuali, così il tempo misurato è quasi
+# tutto del framework e non degli agenti.
+
+
+class RandomPacman(Agent):
+    """
+    Pacman che sceglie a caso tra le azioni legali.
+    """
+
+    def getAction(self, state):
+        return random.choice(state.getLegalPacmanActions())
+
+
+def main(argv):
+    parser = OptionParser("python benchmark_games.py <options>")
+    parser.add_option("-l", "--layout", dest="layout", default="smallClassic")
+    parser.add_option("-n", "--numGames", dest="numGames", type="int", default=2000)
+    parser.add_option("-k", "--numghosts", dest="numGhosts", type="int", default=2)
+    parser.add_option("-s", "--seed", dest="seed", default="cs188")
+    options, _ = parser.parse_args(argv)
+
+    random.seed(options.seed)
+    ghosts = [ghostAgents.RandomGhost(i + 1) for i in range(options.numGhosts)]
+    util.mutePrint()
+    try:
+        start = time.perf_counter()
+        games = pacman.runGames(
+            layout.getLayout(options.layout),
+            RandomPacman(),
+            ghosts,
+            textDisplay.NullGraphics(),
+            options.numGames,
+            False,
+        )
+        elapsed = time.perf_counter() - start
+    finally:
+        util.unmutePrint()
+
+    turns = sum(len(game.moveHistory) for game in games)
+    wins = [game.state.isWin() for game in games].count(True)
+    print("games:           %d (%d won)" % (len(games), wins))
+    print("turns:           %d" % turns)
+    print("games per sec:   %.1f" % (len(games) / elapsed))
+    print("us per turn:     %.1f" % (1e6 * elapsed / turns))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,161 @@
+import random
+import sys
+import time
+from optparse import OptionParser
+
+import ghostAgents
+import layout
+import pacman
+import textDisplay
+import util
+import myValueIterationAgents
+from myValueIterationAgents import MDPAgent
+
+# Confronta win rate e tempo per mossa di diverse configurazioni di MDPAgent.
+#
+# Ogni configurazione è una stringa di argomenti come quella passata a
+# pacman.py con -a; le configurazioni sono separate da ";". Esempio:
+#
+#   python benchmark_mdp.py -l originalClassic -n 20 -c "horizon=0;horizon=10"
+#
+# Con --discounts confronta invece il numero di sweep e il tempo di CPU
+# necessari a ciascuna configurazione per risolvere, partendo da valori
+# nulli, l'MDP dello stato iniziale del layout con diversi fattori di sconto:
+#
+#   python benchmark_mdp.py -l mediumClassic -d 0.5,0.9,1.0 -c "solver=vi;solver=mpi"
+
+
+class TimedMDPAgent(MDPAgent):
+    """
+    MDPAgent che misura il tempo speso in ogni chiamata a getAction.
+    """
+
+    def __init__(self, **args):
+        MDPAgent.__init__(self, **args)
+        self.move_times = []
+
+    def getAction(self, game_state):
+        start = time.perf_counter()
+        action = MDPAgent.getAction(self, game_state)
+        self.move_times.append(time.perf_counter() - start)
+        return action
+
+
+def run_configuration(agent_args, layout_name, num_games, num_ghosts, seed):
+    """
+    Gioca num_games partite silenziose con una configurazione di MDPAgent.
+
+    Returns:
+        (tuple): Win rate, punteggio medio e millisecondi medi per mossa.
+    """
+    random.seed(seed)
+    agent = TimedMDPAgent(**pacman.parseAgentArgs(agent_args or None))
+    ghosts = [ghostAgents.RandomGhost(i + 1) for i in range(num_ghosts)]
+    util.mutePrint()
+    try:
+        games = pacman.runGames(
+            layout.getLayout(layout_name),
+            agent,
+            ghosts,
+            textDisplay.NullGraphics(),
+            num_games,
+            False,
+        )
+    finally:
+        util.unmutePrint()
+    wins = [game.state.isWin() for game in games]
+    scores = [game.state.getScore() for game in games]
+    ms_per_move = 1000 * sum(agent.move_times) / max(1, len(agent.move_times))
+    return wins.count(True) / float(len(wins)), sum(scores) / len(scores), ms_per_move
+
+
+def compare_solvers(agent_args, layout_name, discount):
+    """
+    Risolve da zero l'MDP dello stato iniziale del layout.
+
+    Returns:
+        (tuple): Sweep di miglioramento (o di value iteration), sweep di
+        valutazione della policy, secondi di CPU e convergenza raggiunta.
+    """
+    state = pacman.GameState()
+    state.initialize(layout.getLayout(layout_name))
+    agent = MDPAgent(**pacman.parseAgentArgs(agent_args or None))
+    agent.registerInitialState(state)
+    agent._update_rewards(state)
+
+    myValueIterationAgents.DISCOUNT_FACTOR = discount
+    start = time.process_time()
+    iterations = agent.solve()
+    cpu_time = time.process_time() - start
+
+    converged = iterations is not None
+    sweeps = iterations + 1 if converged else agent.max_iterations
+    evaluation_sweeps = 0
+    if agent.solver == "mpi":
+        evaluation_sweeps = (sweeps - int(converged)) * agent.eval_sweeps
+    return sweeps, evaluation_sweeps, cpu_time, converged
+
+
+def main(argv):
+    parser = OptionParser("python benchmark_mdp.py <options>")
+    parser.add_option("-l", "--layout", dest="layout", default="originalClassic")
+    parser.add_option("-n", "--numGames", dest="numGames", type="int", default=10)
+    parser.add_option("-k", "--numghosts", dest="numGhosts", type="int", default=4)
+    parser.add_option("-s", "--seed", dest="seed", default="cs188")
+    parser.add_option(
+        "-c",
+        "--configs",
+        dest="configs",
+        default="horizon=0;horizon=10;horizon=20",
+        help="Agent argument strings separated by ';'",
+    )
+    parser.add_option(
+        "-d",
+        "--discounts",
+        dest="discounts",
+        default=None,
+        help="Comma separated discount factors: compare solvers instead of games",
+    )
+    options, _ = parser.parse_args(argv)
+
+    if options.discounts:
+        discount_factor = myValueIterationAgents.DISCOUNT_FACTOR
+        print(
+            "%-30s %8s %8s %8s %10s"
+            % ("config", "discount", "sweeps", "eval", "cpu ms")
+        )
+        for discount in [float(d) for d in options.discounts.split(",")]:
+            for agent_args in options.configs.split(";"):
+                sweeps, evaluation_sweeps, cpu_time, converged = compare_solvers(
+                    agent_args, options.layout, discount
+                )
+                print(
+                    "%-30s %8.2f %8s %8d %10.1f"
+                    % (
+                        agent_args or "default",
+                        discount,
+                        sweeps if converged else "max",
+                        evaluation_sweeps,
+                        1000 * cpu_time,
+                    )
+                )
+        myValueIterationAgents.DISCOUNT_FACTOR = discount_factor
+        return
+
+    print("%-30s %8s %10s %10s" % ("config", "win rate", "avg score", "ms/move"))
+    for agent_args in options.configs.split(";"):
+        win_rate, avg_score, ms_per_move = run_configuration(
+            agent_args,
+            options.layout,
+            options.numGames,
+            options.numGhosts,
+            options.seed,
+        )
+        print(
+            "%-30s %8.2f %10.1f %10.1f"
+            % (agent_args or "default", win_rate, avg_score, ms_per_move)
+        )
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
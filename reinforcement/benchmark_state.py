@@ -0,0 +1,94 @@
+import random
+import sys
+import time
+import tracemalloc
+from optparse import OptionParser
+
+import layout
+import pacman
+
+# Misura throughput e memoria di GameState.generateSuccessor giocando partite
+# con mosse casuali per tutti gli agenti. Esempio:
+#
+#   python benchmark_state.py -l originalClassic -n 50
+#
+# Il throughput viene misurato senza tracemalloc; la memoria con due
+# esecuzioni identiche (stesso seme): la prima misura il picco, la seconda i
+# byte occupati da ogni stato quando tutti gli stati restano in vita (come
+# in una tabella Q indicizzata sugli stati). Con -e misura anche il costo
+# della contabilità degli stati esplorati (pacman.ExplorationStats).
+
+
+def play(layout_name, num_games, num_ghosts, seed, keep=False):
+    """
+    Gioca num_games partite casuali generando un successore per ogni mossa.
+
+    Returns:
+        (tuple): Numero di successori generati e stati conservati (se keep).
+    """
+    random.seed(seed)
+    start = pacman.GameState()
+    start.initialize(layout.getLayout(layout_name), num_ghosts)
+    successors = 0
+    kept = []
+    for _ in range(num_games):
+        state = start
+        while not (state.isWin() or state.isLose()):
+            agent = successors % state.getNumAgents()
+            state = state.generateSuccessor(
+                agent, random.choice(state.getLegalActions(agent))
+            )
+            successors += 1
+            if keep:
+                kept.append(state)
+    return successors, kept
+
+
+def main(argv):
+    parser = OptionParser("python benchmark_state.py <options>")
+    parser.add_option("-l", "--layout", dest="layout", default="originalClassic")
+    parser.add_option("-n", "--numGames", dest="numGames", type="int", default=20)
+    parser.add_option("-k", "--numghosts", dest="numGhosts", type="int", default=4)
+    parser.add_option("-s", "--seed", dest="seed", default="cs188")
+    parser.add_option(
+        "-e",
+        "--exploration",
+        action="store_true",
+        dest="exploration",
+        default=False,
+        help="Account for the explored states (see pacman.ExplorationStats)",
+    )
+    options, _ = parser.parse_args(argv)
+    args = (options.layout, options.numGames, options.numGhosts, options.seed)
+    if options.exploration:
+        pacman.GameState.exploration = pacman.ExplorationStats(
+            distinct=True, sampleSize=100
+        )
+
+    start = time.perf_counter()
+    successors, _ = play(*args)
+    elapsed = time.perf_counter() - start
+    if options.exploration:
+        print(pacman.GameState.exploration)
+
+    tracemalloc.start()
+    play(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    before, _ = tracemalloc.get_traced_memory()
+    _, kept = play(*args, keep=True)
+    retained, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print("successors:          %d" % successors)
+    print("us per successor:    %.1f" % (1e6 * elapsed / successors))
+    print("successors per sec:  %.0f" % (successors / elapsed))
+    print("peak KiB:            %.0f" % (peak / 1024.0))
+    print(
+        "retained B/state:    %.0f"
+        % ((retained - before) / float(max(1, len(kept))))
+    )
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -22,6 +22,8 @@
 
 from util import *
 import time, os
+import random
+import struct
 import traceback
 import sys
 
@@ -36,6 +38,9 @@ class Agent:
     following methods which will be called if they exist:
 
     def registerInitialState(self, state): # inspects the starting state
+    def setGameIndex(self, index): # the position of the next game in the run,
+                                   # for games played out of order (see
+                                   # pacman.runParallelGames)
     """
 
     def __init__(self, index=0):
@@ -78,8 +83,13 @@ class Configuration:
 
     The convention for positions, like a graph, is that (0,0) is the lower left corner, x increases
     horizontally and y increases vertically.  Therefore, north is the direction of increasing y, or (0,1).
+
+    Configurations are shared between successive states, so they should not be
+    modified: create a new one instead.
     """
 
+    __slots__ = ("pos", "direction")
+
     def __init__(self, pos, direction):
         self.pos = pos
         self.direction = direction
@@ -126,8 +136,20 @@ class Configuration:
 class AgentState:
     """
     AgentStates hold the state of an agent (configuration, speed, scared, etc).
+
+    A successor state shares the AgentStates of the agents that did not change
+    with its predecessor; see GameStateData.getMutableAgentState.
     """
 
+    __slots__ = (
+        "start",
+        "configuration",
+        "isPacman",
+        "scaredTimer",
+        "numCarrying",
+        "numReturned",
+    )
+
     def __init__(self, startConfiguration, isPacman):
         self.start = startConfiguration
         self.configuration = startConfiguration
@@ -170,15 +192,43 @@ class AgentState:
         return self.configuration.getDirection()
 
 
+class _GridColumn(bytearray):
+    """
+    A column of a Grid: one byte (0 or 1) per cell.  Reads are plain bytearray
+    reads; writes also clear the cache (hash and derived tables) shared by the
+    Grids using it.  A Grid owns the columns whose cache is its own; the others
+    belong to the grid it was copied from (see Grid.copyOnWrite).
+    """
+
+    __slots__ = ("cache",)
+
+    def __setitem__(self, key, item):
+        self.cache.clear()
+        bytearray.__setitem__(self, key, item)
+
+
+# Maps the bytes of a Grid to the ASCII digits of a binary number
+_BIT_DIGITS = bytes.maketrans(b"\x00\x01", b"01")
+
+
 class Grid:
     """
-    A 2-dimensional array of objects backed by a list of lists.  Data is accessed
-    via grid[x][y] where (x,y) are positions on a Pacman map with x horizontal,
-    y vertical and the origin (0,0) in the bottom left corner.
+    A 2-dimensional array of booleans backed by one bytearray per column.  Data
+    is accessed via grid[x][y] where (x,y) are positions on a Pacman map with x
+    horizontal, y vertical and the origin (0,0) in the bottom left corner.
+    Cells read back as 1 or 0.
+
+    Counting, copying and comparing work on whole columns at C speed, and the
+    hash, like any table built with getCached, is cached until the grid is
+    next written to.
 
     The __str__ method constructs an output that is oriented like a pacman board.
     """
 
+    # True if shallow copies must not write to the columns of this grid
+    # either (see copyOnWrite)
+    _copyOnWrite = False
+
     def __init__(self, width, height, initialValue=False, bitRepresentation=None):
         if initialValue not in [False, True]:
             raise Exception("Grids can only contain booleans")
@@ -186,19 +236,31 @@ class Grid:
 
         self.width = width
         self.height = height
-        self.data = [[initialValue for y in range(height)] for x in range(width)]
+        self._cache = {}
+        self.data = [self._column(bytes([initialValue]) * height) for x in range(width)]
         if bitRepresentation:
             self._unpackBits(bitRepresentation)
 
+    def _column(self, cells):
+        column = _GridColumn(cells)
+        column.cache = self._cache
+        return column
+
     def __getitem__(self, i):
-        return self.data[i]
+        column = self.data[i]
+        if column.cache is not self._cache:
+            # Still the column of the grid this one was copied from: copy it
+            # before handing it out, as it may be written to
+            column = self.data[i] = self._column(column)
+        return column
 
     def __setitem__(self, key, item):
-        self.data[key] = item
+        self._cache.clear()
+        self.data[key] = self._column(item)
 
     def __str__(self):
         out = [
-            [str(self.data[x][y])[0] for x in range(self.width)]
+            ["FT"[self.data[x][y]] for x in range(self.width)]
             for y in range(self.height)
         ]
         out.reverse()
@@ -210,40 +272,85 @@ class Grid:
         return self.data == other.data
 
     def __hash__(self):
-        # return hash(str(self))
-        base = 1
-        h = 0
-        for l in self.data:
-            for i in l:
-                if i:
-                    h += base
-                base *= 2
-        return hash(h)
+        # The same value as hashing the integer with bit x * height + y set
+        # for each true cell (x, y)
+        h = self._cache.get("hash")
+        if h is None:
+            digits = b"".join(self.data)[::-1].translate(_BIT_DIGITS)
+            h = hash(int(digits, 2)) if digits else hash(0)
+            self._cache["hash"] = h
+        return h
+
+    def getCached(self, key, build):
+        """
+        Returns build(self), calling build only the first time the key is
+        requested since the grid was last written to.
+        """
+        cache = self._cache
+        if key not in cache:
+            cache[key] = build(self)
+        return cache[key]
 
     def copy(self):
-        g = Grid(self.width, self.height)
-        g.data = [x[:] for x in self.data]
+        g = Grid.__new__(Grid)
+        g.CELLS_PER_INT = self.CELLS_PER_INT
+        g.width = self.width
+        g.height = self.height
+        g._cache = dict(self._cache)
+        g.data = [g._column(x) for x in self.data]
         return g
 
     def deepCopy(self):
         return self.copy()
 
     def shallowCopy(self):
-        g = Grid(self.width, self.height)
+        if self._copyOnWrite:
+            return self.copyOnWrite()
+        g = Grid.__new__(Grid)
+        g.CELLS_PER_INT = self.CELLS_PER_INT
+        g.width = self.width
+        g.height = self.height
+        g._cache = self._cache
         g.data = self.data
         return g
 
+    def copyOnWrite(self):
+        """
+        Returns a Grid that shares its columns with this one and copies each
+        column the first time it is accessed, so writes to it (or to its
+        shallow copies) never reach this grid.  Creating it costs O(width);
+        reads through whole-grid methods (count, asList, ==, hash) copy
+        nothing.
+        """
+        g = Grid.__new__(Grid)
+        g.CELLS_PER_INT = self.CELLS_PER_INT
+        g.width = self.width
+        g.height = self.height
+        g._cache = dict(self._cache)
+        g.data = list(self.data)
+        g._copyOnWrite = True
+        return g
+
     def count(self, item=True):
-        return sum([x.count(item) for x in self.data])
+        return b"".join(self.data).count(item)
 
     def asList(self, key=True):
         list = []
         for x in range(self.width):
-            for y in range(self.height):
-                if self[x][y] == key:
-                    list.append((x, y))
+            column = self.data[x]
+            y = column.find(key)
+            while y != -1:
+                list.append((x, y))
+                y = column.find(key, y + 1)
         return list
 
+    def toBytes(self):
+        """
+        Returns the grid in the compact binary format read by gridFromBytes:
+        a version byte, the width and height, then one bit per cell.
+        """
+        return bytes([CODEC_VERSION]) + _packGrid(self)
+
     def packBits(self):
         """
         Returns an efficient int list representation
@@ -264,7 +371,7 @@ class Grid:
         return tuple(bits)
 
     def _cellIndexToPosition(self, index):
-        x = index / self.height
+        x = index // self.height
         y = index % self.height
         return x, y
 
@@ -302,6 +409,214 @@ def reconstituteGrid(bitRep):
     return Grid(width, height, bitRepresentation=bitRep[2:])
 
 
+##########################
+# Compact binary format  #
+##########################
+
+# Version of the format written by Grid.toBytes and GameStateData.toBytes.
+# Data written with another version is rejected.
+CODEC_VERSION = 1
+
+_GRID_HEADER = struct.Struct("<HH")
+_STATE_HEADER = struct.Struct("<BBdbhhhh")
+_CAPSULE = struct.Struct("<HH")
+# isPacman and other flags, position, direction, start position, start
+# direction, scared timer, food carried and food returned
+_AGENT = struct.Struct("<BddBddBhHH")
+
+_DIRECTION_CODES = [
+    Directions.NORTH,
+    Directions.SOUTH,
+    Directions.EAST,
+    Directions.WEST,
+    Directions.STOP,
+]
+_DIRECTION_INDEX = dict((d, i) for i, d in enumerate(_DIRECTION_CODES))
+_BIT_BYTES = bytes.maketrans(b"01", b"\x00\x01")
+
+# Flags of the state header
+_WIN, _LOSE, _INTEGER_SCORE = 1, 2, 4
+# Flags of an agent record.  Positions are stored as doubles; the INTEGER
+# flags tell which ones were ints, so they can still index grids.
+_PACMAN, _EATEN, _HAS_CONFIGURATION = 1, 2, 4
+_INTEGER_POSITION, _INTEGER_START = 8, 16
+
+
+def _packGrid(grid):
+    # Bit x * height + y is set for each true cell (x, y), as in Grid.__hash__
+    cells = grid.width * grid.height
+    digits = b"".join(grid.data)[::-1].translate(_BIT_DIGITS)
+    bits = int(digits, 2) if digits else 0
+    return _GRID_HEADER.pack(grid.width, grid.height) + bits.to_bytes(
+        (cells + 7) // 8, "little"
+    )
+
+
+def _unpackGrid(data, offset):
+    width, height = _GRID_HEADER.unpack_from(data, offset)
+    offset += _GRID_HEADER.size
+    cells = width * height
+    size = (cells + 7) // 8
+    if offset + size > len(data):
+        raise Exception("Truncated grid data")
+    bits = int.from_bytes(data[offset : offset + size], "little")
+    if bits >> cells:
+        raise Exception("Grid data has bits outside the grid")
+    cellBytes = format(bits, "0%db" % cells).encode("ascii")[::-1]
+    cellBytes = cellBytes.translate(_BIT_BYTES)
+    grid = Grid.__new__(Grid)
+    grid.CELLS_PER_INT = 30
+    grid.width = width
+    grid.height = height
+    grid._cache = {}
+    grid.data = [
+        grid._column(cellBytes[x * height : (x + 1) * height]) for x in range(width)
+    ]
+    return grid, offset + size
+
+
+def _checkVersion(data):
+    if not data or data[0] != CODEC_VERSION:
+        raise Exception(
+            "Unsupported encoding version %s" % (data[0] if data else None)
+        )
+
+
+def gridFromBytes(data):
+    """
+    Rebuilds a Grid from the output of Grid.toBytes.
+    """
+    _checkVersion(data)
+    grid, offset = _unpackGrid(data, 1)
+    if offset != len(data):
+        raise Exception("Trailing bytes after grid data")
+    return grid
+
+
+def _packPosition(pos):
+    return pos if pos != None else (-1, -1)
+
+
+def _unpackPosition(x, y):
+    return None if (x, y) == (-1, -1) else (x, y)
+
+
+def _packAgent(agentState, eaten):
+    flags = 0
+    if agentState.isPacman:
+        flags |= _PACMAN
+    if eaten:
+        flags |= _EATEN
+    x = y = 0.0
+    direction = 0
+    configuration = agentState.configuration
+    if configuration != None:
+        flags |= _HAS_CONFIGURATION
+        x, y = configuration.pos
+        direction = _DIRECTION_INDEX[configuration.direction]
+        if type(x) is int and type(y) is int:
+            flags |= _INTEGER_POSITION
+    start = agentState.start
+    startX, startY = start.pos
+    if type(startX) is int and type(startY) is int:
+        flags |= _INTEGER_START
+    return _AGENT.pack(
+        flags,
+        x,
+        y,
+        direction,
+        startX,
+        startY,
+        _DIRECTION_INDEX[start.direction],
+        agentState.scaredTimer,
+        agentState.numCarrying,
+        agentState.numReturned,
+    )
+
+
+def _unpackAgent(record):
+    (
+        flags,
+        x,
+        y,
+        direction,
+        startX,
+        startY,
+        startDirection,
+        scaredTimer,
+        numCarrying,
+        numReturned,
+    ) = record
+    if flags & _INTEGER_START:
+        startX, startY = int(startX), int(startY)
+    start = Configuration((startX, startY), _DIRECTION_CODES[startDirection])
+    agentState = AgentState(start, bool(flags & _PACMAN))
+    if flags & _HAS_CONFIGURATION:
+        if flags & _INTEGER_POSITION:
+            x, y = int(x), int(y)
+        agentState.configuration = Configuration((x, y), _DIRECTION_CODES[direction])
+    else:
+        agentState.configuration = None
+    agentState.scaredTimer = scaredTimer
+    agentState.numCarrying = numCarrying
+    agentState.numReturned = numReturned
+    return agentState, bool(flags & _EATEN)
+
+
+def stateDataFromBytes(data, layout):
+    """
+    Rebuilds a GameStateData from the output of GameStateData.toBytes.  The
+    layout is not stored, only its walls: they must match the given layout.
+    """
+    _checkVersion(data)
+    (
+        version,
+        flags,
+        score,
+        agentMoved,
+        foodEatenX,
+        foodEatenY,
+        capsuleEatenX,
+        capsuleEatenY,
+    ) = _STATE_HEADER.unpack_from(data, 0)
+    offset = _STATE_HEADER.size
+    walls = layout.walls.getCached("packed", _packGrid)
+    if data[offset : offset + len(walls)] != walls:
+        raise Exception("The state was encoded for a different layout")
+    offset += len(walls)
+    food, offset = _unpackGrid(data, offset)
+
+    (numCapsules,) = struct.unpack_from("<H", data, offset)
+    offset += 2
+    capsules = [
+        _CAPSULE.unpack_from(data, offset + i * _CAPSULE.size)
+        for i in range(numCapsules)
+    ]
+    offset += numCapsules * _CAPSULE.size
+
+    numAgents = data[offset]
+    offset += 1
+    end = offset + numAgents * _AGENT.size
+    if end != len(data):
+        raise Exception("Malformed state data")
+    agents = [_unpackAgent(r) for r in _AGENT.iter_unpack(data[offset:end])]
+
+    state = GameStateData()
+    state.layout = layout
+    state.food = food
+    state.capsules = capsules
+    state.agentStates = [agentState for agentState, eaten in agents]
+    state._eaten = [eaten for agentState, eaten in agents]
+    state._ownedAgents = (1 << numAgents) - 1
+    state.score = int(score) if flags & _INTEGER_SCORE else score
+    state._win = bool(flags & _WIN)
+    state._lose = bool(flags & _LOSE)
+    state._agentMoved = None if agentMoved < 0 else agentMoved
+    state._foodEaten = _unpackPosition(foodEatenX, foodEatenY)
+    state._capsuleEaten = _unpackPosition(capsuleEatenX, capsuleEatenY)
+    return state
+
+
 ####################################
 # Parts you shouldn't have to read #
 ####################################
@@ -359,6 +674,20 @@ class Actions:
     directionToVector = staticmethod(directionToVector)
 
     def getPossibleActions(config, walls):
+        return list(Actions._possibleActions(config, walls))
+
+    getPossibleActions = staticmethod(getPossibleActions)
+
+    def _possibleActions(config, walls):
+        """
+        Like getPossibleActions, but the result may be a tuple shared with
+        other callers: it must not be modified.
+        """
+        possible = Actions._moveTables(walls)[0].get(config.pos)
+        if possible != None:
+            return possible
+
+        # Off the grid points (scared ghosts) or next to the border
         possible = []
         x, y = config.pos
         x_int, y_int = int(x + 0.5), int(y + 0.5)
@@ -376,11 +705,19 @@ class Actions:
 
         return possible
 
-    getPossibleActions = staticmethod(getPossibleActions)
+    _possibleActions = staticmethod(_possibleActions)
 
     def getLegalNeighbors(position, walls):
         x, y = position
         x_int, y_int = int(x + 0.5), int(y + 0.5)
+        neighbors = Actions._moveTables(walls)[1].get((x_int, y_int))
+        if neighbors != None:
+            return list(neighbors)
+        return Actions._legalNeighbors(x_int, y_int, walls)
+
+    getLegalNeighbors = staticmethod(getLegalNeighbors)
+
+    def _legalNeighbors(x_int, y_int, walls):
         neighbors = []
         for dir, vec in Actions._directionsAsList:
             dx, dy = vec
@@ -394,7 +731,35 @@ class Actions:
                 neighbors.append((next_x, next_y))
         return neighbors
 
-    getLegalNeighbors = staticmethod(getLegalNeighbors)
+    _legalNeighbors = staticmethod(_legalNeighbors)
+
+    def _moveTables(walls):
+        """
+        Returns two dicts mapping each integer cell of the layout to the tuple
+        of its legal actions and to the tuple of its legal neighbors.  They
+        are built once per wall grid, so once per layout.
+        """
+        return walls.getCached("moveTables", Actions._buildMoveTables)
+
+    _moveTables = staticmethod(_moveTables)
+
+    def _buildMoveTables(walls):
+        actions = {}
+        neighbors = {}
+        for x in range(walls.width):
+            for y in range(walls.height):
+                neighbors[(x, y)] = tuple(Actions._legalNeighbors(x, y, walls))
+                # Border cells are left to the fallback, which does not
+                # check the bounds
+                if 0 < x < walls.width - 1 and 0 < y < walls.height - 1:
+                    actions[(x, y)] = tuple(
+                        dir
+                        for dir, (dx, dy) in Actions._directionsAsList
+                        if not walls[x + dx][y + dy]
+                    )
+        return actions, neighbors
+
+    _buildMoveTables = staticmethod(_buildMoveTables)
 
     def getSuccessor(position, action):
         dx, dy = Actions.directionToVector(action)
@@ -404,6 +769,23 @@ class Actions:
     getSuccessor = staticmethod(getSuccessor)
 
 
+# Random keys for Zobrist hashing, one table per board size
+ZOBRIST_TABLE_CACHE = {}
+
+
+def zobristTable(width, height):
+    """
+    Returns one random 64-bit key per cell for food, followed by one per cell
+    for capsules.  The keys only depend on the board size.
+    """
+    table = ZOBRIST_TABLE_CACHE.get((width, height))
+    if table == None:
+        generator = random.Random("zobrist %d %d" % (width, height))
+        table = [generator.getrandbits(64) for i in range(2 * width * height)]
+        ZOBRIST_TABLE_CACHE[(width, height)] = table
+    return table
+
+
 class GameStateData:
     """ """
 
@@ -411,13 +793,23 @@ class GameStateData:
         """
         Generates a new data packet by copying information from its predecessor.
         """
+        # Zobrist hash of food and capsules, and hash of each agent state; None
+        # until the state is first hashed.  See updateHash.
+        self._boardKey = None
+        self._agentKeys = None
+        # Bit i is set once agentStates[i] has been copied for this state
+        self._ownedAgents = 0
         if prevState != None:
             self.food = prevState.food.shallowCopy()
             self.capsules = prevState.capsules[:]
-            self.agentStates = self.copyAgentStates(prevState.agentStates)
+            # Shared until changed: see getMutableAgentState
+            self.agentStates = prevState.agentStates[:]
             self.layout = prevState.layout
             self._eaten = prevState._eaten
             self.score = prevState.score
+            if prevState._boardKey != None:
+                self._boardKey = prevState._boardKey
+                self._agentKeys = prevState._agentKeys[:]
 
         self._foodEaten = None
         self._foodAdded = None
@@ -428,21 +820,82 @@ class GameStateData:
         self.scoreChange = 0
 
     def deepCopy(self):
-        state = GameStateData(self)
+        state = self.snapshot()
+        state.agentStates = self.copyAgentStates(self.agentStates)
+        state._ownedAgents = (1 << len(self.agentStates)) - 1
         state.food = self.food.deepCopy()
-        state.layout = self.layout.deepCopy()
+        return state
+
+    def snapshot(self):
+        """
+        Returns a copy that shares the food grid (see Grid.copyOnWrite) and
+        agent states (see getMutableAgentState) with this one until they are
+        changed, and the layout, which never changes.  Copying costs
+        O(number of agents).
+        """
+        state = GameStateData(self)
+        state.food = self.food.copyOnWrite()
         state._agentMoved = self._agentMoved
         state._foodEaten = self._foodEaten
         state._foodAdded = self._foodAdded
         state._capsuleEaten = self._capsuleEaten
         return state
 
+    def getMutableAgentState(self, agentIndex):
+        """
+        Returns the AgentState of agentIndex for modification, first copying it
+        if it is still shared with the predecessor state.
+        """
+        if not self._ownedAgents >> agentIndex & 1:
+            self.agentStates[agentIndex] = self.agentStates[agentIndex].copy()
+            self._ownedAgents |= 1 << agentIndex
+        return self.agentStates[agentIndex]
+
     def copyAgentStates(self, agentStates):
         copiedStates = []
         for agentState in agentStates:
             copiedStates.append(agentState.copy())
         return copiedStates
 
+    def toBytes(self):
+        """
+        Returns the state in the compact binary format read by
+        stateDataFromBytes: a header with the score, the flags and the last
+        move's effects, the walls and food as packed bits, the capsules, then
+        one fixed-width record per agent.  The layout itself is not stored.
+        """
+        flags = 0
+        if self._win:
+            flags |= _WIN
+        if self._lose:
+            flags |= _LOSE
+        if type(self.score) is int:
+            flags |= _INTEGER_SCORE
+        agentMoved = self._agentMoved
+        foodEaten = _packPosition(self._foodEaten)
+        capsuleEaten = _packPosition(self._capsuleEaten)
+        parts = [
+            _STATE_HEADER.pack(
+                CODEC_VERSION,
+                flags,
+                self.score,
+                -1 if agentMoved == None else agentMoved,
+                foodEaten[0],
+                foodEaten[1],
+                capsuleEaten[0],
+                capsuleEaten[1],
+            ),
+            self.layout.walls.getCached("packed", _packGrid),
+            _packGrid(self.food),
+            struct.pack("<H", len(self.capsules)),
+        ]
+        for x, y in self.capsules:
+            parts.append(_CAPSULE.pack(x, y))
+        parts.append(bytes([len(self.agentStates)]))
+        for agentState, eaten in zip(self.agentStates, self._eaten):
+            parts.append(_packAgent(agentState, eaten))
+        return b"".join(parts)
+
     def __eq__(self, other):
         """
         Allows two states to be compared.
@@ -463,32 +916,67 @@ class GameStateData:
     def __hash__(self):
         """
         Allows states to be keys of dictionaries.
+
+        The food and capsules are hashed with Zobrist keys that updateHash keeps
+        up to date from one state to the next, so hashing does not depend on
+        the size of the board.
         """
-        for i, state in enumerate(self.agentStates):
-            try:
-                int(hash(state))
-            except TypeError as e:
-                print(e)
-                # hash(state)
-        return int(
-            (
-                hash(tuple(self.agentStates))
-                + 13 * hash(self.food)
-                + 113 * hash(tuple(self.capsules))
-                + 7 * hash(self.score)
-            )
-            % 1048575
-        )
+        if self._boardKey == None:
+            self._computeHash()
+        h = self._boardKey ^ hash(self.score)
+        for key in self._agentKeys:
+            h ^= key
+        return h
+
+    def _computeHash(self):
+        width, height = self.food.width, self.food.height
+        table = zobristTable(width, height)
+        boardKey = 0
+        for x, y in self.food.asList():
+            boardKey ^= table[x * height + y]
+        for x, y in self.capsules:
+            boardKey ^= table[(width + x) * height + y]
+        self._boardKey = boardKey
+        self._agentKeys = [self._agentKey(i) for i in range(len(self.agentStates))]
+
+    def _agentKey(self, agentIndex):
+        return hash((agentIndex, self.agentStates[agentIndex]))
+
+    def updateHash(self, agentIndex):
+        """
+        Brings the hash up to date after agentIndex has moved, XORing out and in
+        the food and capsule eaten and the agents that changed: the one that
+        moved, any ghost that was eaten and, when a capsule was eaten, all the
+        ghosts it scared.  Called by GameState.generateSuccessor.
+        """
+        if self._boardKey == None:
+            return
+        width, height = self.food.width, self.food.height
+        table = zobristTable(width, height)
+        for position in (self._foodEaten, self._foodAdded):
+            if position != None:
+                x, y = position
+                self._boardKey ^= table[x * height + y]
+        if self._capsuleEaten != None:
+            x, y = self._capsuleEaten
+            self._boardKey ^= table[(width + x) * height + y]
+            changed = range(len(self.agentStates))
+        else:
+            changed = set([agentIndex])
+            changed.update(i for i, eaten in enumerate(self._eaten) if eaten)
+        for i in changed:
+            self._agentKeys[i] = self._agentKey(i)
 
     def __str__(self):
         width, height = self.layout.width, self.layout.height
-        map = Grid(width, height)
         if type(self.food) == type((1, 2)):
             self.food = reconstituteGrid(self.food)
-        for x in range(width):
-            for y in range(height):
-                food, walls = self.food, self.layout.walls
-                map[x][y] = self._foodWallStr(food[x][y], walls[x][y])
+        # Grids only hold booleans, so the characters go in a list of columns
+        food, walls = self.food, self.layout.walls
+        map = [
+            [self._foodWallStr(food[x][y], walls[x][y]) for y in range(height)]
+            for x in range(width)
+        ]
 
         for agentState in self.agentStates:
             if agentState == None:
@@ -505,7 +993,9 @@ class GameStateData:
         for x, y in self.capsules:
             map[x][y] = "o"
 
-        return str(map) + ("\nScore: %d\n" % self.score)
+        rows = ["".join(map[x][y] for x in range(width)) for y in range(height)]
+        rows.reverse()
+        return "\n".join(rows) + ("\nScore: %d\n" % self.score)
 
     def _foodWallStr(self, hasFood, hasWall):
         if hasFood:
@@ -544,6 +1034,8 @@ class GameStateData:
         self.layout = layout
         self.score = 0
         self.scoreChange = 0
+        self._boardKey = None
+        self._agentKeys = None
 
         self.agentStates = []
         numGhosts = 0
@@ -557,6 +1049,7 @@ class GameStateData:
                 AgentState(Configuration(pos, Directions.STOP), isPacman)
             )
         self._eaten = [False for a in self.agentStates]
+        self._ownedAgents = (1 << len(self.agentStates)) - 1
 
 
 try:
@@ -588,6 +1081,7 @@ class Game:
         self.startingIndex = startingIndex
         self.gameOver = False
         self.muteAgents = muteAgents
+        self.muting = muteAgents
         self.catchExceptions = catchExceptions
         self.moveHistory = []
         self.totalAgentTimes = [0 for agent in agents]
@@ -616,11 +1110,14 @@ class Game:
     OLD_STDOUT = None
     OLD_STDERR = None
 
+    def _shouldMute(self):
+        # Redirecting output that already goes nowhere is wasted work
+        return self.muteAgents and not isinstance(sys.stdout, WritableNull)
+
     def mute(self, agentIndex):
-        if not self.muteAgents:
+        if not self.muting:
             return
         global OLD_STDOUT, OLD_STDERR
-        import cStringIO
 
         OLD_STDOUT = sys.stdout
         OLD_STDERR = sys.stderr
@@ -628,19 +1125,130 @@ class Game:
         sys.stderr = self.agentOutput[agentIndex]
 
     def unmute(self):
-        if not self.muteAgents:
+        if not self.muting:
             return
         global OLD_STDOUT, OLD_STDERR
         # Revert stdout/stderr to originals
         sys.stdout = OLD_STDOUT
         sys.stderr = OLD_STDERR
 
+    def _timedAction(self, agentIndex):
+        """
+        Observes the state and solicits an action for the main loop of run
+        when catchExceptions is on: the agent is timed and its exceptions are
+        caught.  If the agent crashes or runs out of time the game is over,
+        agentCrashed is set and None is returned.
+        """
+        agent = self.agents[agentIndex]
+        move_time = 0
+        skip_action = False
+        # Generate an observation of the state
+        observationFunction = self.observationFunctions[agentIndex]
+        if observationFunction != None:
+            self.mute(agentIndex)
+            try:
+                timed_func = DeadlineFunction(
+                    observationFunction,
+                    self.rules.getMoveTimeout(agentIndex),
+                )
+                try:
+                    start_time = time.monotonic()
+                    observation = timed_func(self.state.snapshot())
+                except TimeoutFunctionException:
+                    skip_action = True
+                move_time += time.monotonic() - start_time
+                self.unmute()
+            except Exception as data:
+                self._agentCrash(agentIndex, quiet=False)
+                self.unmute()
+                return
+            self.unmute()
+        else:
+            observation = self.state.snapshot()
+
+        # Solicit an action
+        action = None
+        self.mute(agentIndex)
+        try:
+            # The deadline agents see (util.currentDeadline) also accounts
+            # for what is left of their time for the whole game
+            timeout = min(
+                self.rules.getMoveTimeout(agentIndex) - move_time,
+                self.rules.getMaxTotalTime(agentIndex)
+                - self.totalAgentTimes[agentIndex],
+            )
+            timed_func = DeadlineFunction(agent.getAction, timeout)
+            try:
+                start_time = time.monotonic()
+                if skip_action:
+                    raise TimeoutFunctionException()
+                action = timed_func(observation)
+            except TimeoutFunctionException:
+                print(
+                    "Agent %d timed out on a single move!" % agentIndex,
+                    file=sys.stderr,
+                )
+                self.agentTimeout = True
+                self._agentCrash(agentIndex, quiet=True)
+                self.unmute()
+                return
+
+            move_time += time.monotonic() - start_time
+
+            if move_time > self.rules.getMoveWarningTime(agentIndex):
+                self.totalAgentTimeWarnings[agentIndex] += 1
+                print(
+                    "Agent %d took too long to make a move! This is warning %d"
+                    % (agentIndex, self.totalAgentTimeWarnings[agentIndex]),
+                    file=sys.stderr,
+                )
+                if self.totalAgentTimeWarnings[
+                    agentIndex
+                ] > self.rules.getMaxTimeWarnings(agentIndex):
+                    print(
+                        "Agent %d exceeded the maximum number of warnings: %d"
+                        % (agentIndex, self.totalAgentTimeWarnings[agentIndex]),
+                        file=sys.stderr,
+                    )
+                    self.agentTimeout = True
+                    self._agentCrash(agentIndex, quiet=True)
+                    self.unmute()
+                    return
+
+            self.totalAgentTimes[agentIndex] += move_time
+            # print "Agent: %d, time: %f, total: %f" % (agentIndex, move_time, self.totalAgentTimes[agentIndex])
+            if self.totalAgentTimes[agentIndex] > self.rules.getMaxTotalTime(
+                agentIndex
+            ):
+                print(
+                    "Agent %d ran out of time! (time: %1.2f)"
+                    % (agentIndex, self.totalAgentTimes[agentIndex]),
+                    file=sys.stderr,
+                )
+                self.agentTimeout = True
+                self._agentCrash(agentIndex, quiet=True)
+                self.unmute()
+                return
+            self.unmute()
+        except Exception as data:
+            self._agentCrash(agentIndex)
+            self.unmute()
+            return
+        self.unmute()
+        return action
+
     def run(self):
         """
         Main control loop for game play.
         """
         self.display.initialize(self.state.data)
         self.numMoves = 0
+        self.muting = self._shouldMute()
+
+        # Look up the optional agent hooks once, rather than every turn
+        self.observationFunctions = [
+            getattr(agent, "observationFunction", None) for agent in self.agents
+        ]
 
         ###self.display.initialize(self.state.makeObservation(1).data)
         # inform learning agents of the game start
@@ -650,25 +1258,25 @@ class Game:
                 self.mute(i)
                 # this is a null agent, meaning it failed to load
                 # the other team wins
-                print >> sys.stderr, "Agent %d failed to load" % i
+                print("Agent %d failed to load" % i, file=sys.stderr)
                 self.unmute()
                 self._agentCrash(i, quiet=True)
                 return
-            if "registerInitialState" in dir(agent):
+            if hasattr(agent, "registerInitialState"):
                 self.mute(i)
                 if self.catchExceptions:
                     try:
-                        timed_func = TimeoutFunction(
+                        timed_func = DeadlineFunction(
                             agent.registerInitialState,
-                            int(self.rules.getMaxStartupTime(i)),
+                            self.rules.getMaxStartupTime(i),
                         )
                         try:
-                            start_time = time.time()
-                            timed_func(self.state.deepCopy())
-                            time_taken = time.time() - start_time
+                            start_time = time.monotonic()
+                            timed_func(self.state.snapshot())
+                            time_taken = time.monotonic() - start_time
                             self.totalAgentTimes[i] += time_taken
                         except TimeoutFunctionException:
-                            print >> sys.stderr, "Agent %d ran out of time on startup!" % i
+                            print("Agent %d ran out of time on startup!" % i, file=sys.stderr)
                             self.unmute()
                             self.agentTimeout = True
                             self._agentCrash(i, quiet=True)
@@ -678,7 +1286,7 @@ class Game:
                         self.unmute()
                         return
                 else:
-                    agent.registerInitialState(self.state.deepCopy())
+                    agent.registerInitialState(self.state.snapshot())
                 ## TODO: could this exceed the total time
                 self.unmute()
 
@@ -686,98 +1294,22 @@ class Game:
         numAgents = len(self.agents)
 
         while not self.gameOver:
-            # Fetch the next agent
-            agent = self.agents[agentIndex]
-            move_time = 0
-            skip_action = False
-            # Generate an observation of the state
-            if "observationFunction" in dir(agent):
-                self.mute(agentIndex)
-                if self.catchExceptions:
-                    try:
-                        timed_func = TimeoutFunction(
-                            agent.observationFunction,
-                            int(self.rules.getMoveTimeout(agentIndex)),
-                        )
-                        try:
-                            start_time = time.time()
-                            observation = timed_func(self.state.deepCopy())
-                        except TimeoutFunctionException:
-                            skip_action = True
-                        move_time += time.time() - start_time
-                        self.unmute()
-                    except Exception as data:
-                        self._agentCrash(agentIndex, quiet=False)
-                        self.unmute()
-                        return
-                else:
-                    observation = agent.observationFunction(self.state.deepCopy())
-                self.unmute()
-            else:
-                observation = self.state.deepCopy()
-
-            # Solicit an action
-            action = None
-            self.mute(agentIndex)
             if self.catchExceptions:
-                try:
-                    timed_func = TimeoutFunction(
-                        agent.getAction,
-                        int(self.rules.getMoveTimeout(agentIndex)) - int(move_time),
-                    )
-                    try:
-                        start_time = time.time()
-                        if skip_action:
-                            raise TimeoutFunctionException()
-                        action = timed_func(observation)
-                    except TimeoutFunctionException:
-                        print >> sys.stderr, "Agent %d timed out on a single move!" % agentIndex
-                        self.agentTimeout = True
-                        self._agentCrash(agentIndex, quiet=True)
-                        self.unmute()
-                        return
-
-                    move_time += time.time() - start_time
-
-                    if move_time > self.rules.getMoveWarningTime(agentIndex):
-                        self.totalAgentTimeWarnings[agentIndex] += 1
-                        print >> sys.stderr, "Agent %d took too long to make a move! This is warning %d" % (
-                            agentIndex,
-                            self.totalAgentTimeWarnings[agentIndex],
-                        )
-                        if self.totalAgentTimeWarnings[
-                            agentIndex
-                        ] > self.rules.getMaxTimeWarnings(agentIndex):
-                            print >> sys.stderr, "Agent %d exceeded the maximum number of warnings: %d" % (
-                                agentIndex,
-                                self.totalAgentTimeWarnings[agentIndex],
-                            )
-                            self.agentTimeout = True
-                            self._agentCrash(agentIndex, quiet=True)
-                            self.unmute()
-                            return
-
-                    self.totalAgentTimes[agentIndex] += move_time
-                    # print "Agent: %d, time: %f, total: %f" % (agentIndex, move_time, self.totalAgentTimes[agentIndex])
-                    if self.totalAgentTimes[agentIndex] > self.rules.getMaxTotalTime(
-                        agentIndex
-                    ):
-                        print >> sys.stderr, "Agent %d ran out of time! (time: %1.2f)" % (
-                            agentIndex,
-                            self.totalAgentTimes[agentIndex],
-                        )
-                        self.agentTimeout = True
-                        self._agentCrash(agentIndex, quiet=True)
-                        self.unmute()
-                        return
-                    self.unmute()
-                except Exception as data:
-                    self._agentCrash(agentIndex)
-                    self.unmute()
+                action = self._timedAction(agentIndex)
+                if self.agentCrashed:
                     return
             else:
-                action = agent.getAction(observation)
-            self.unmute()
+                # Generate an observation of the state.  Agents get a
+                # snapshot: changes to it never reach the game state, and it
+                # saves a deep copy every turn
+                self.mute(agentIndex)
+                observation = self.state.snapshot()
+                observationFunction = self.observationFunctions[agentIndex]
+                if observationFunction != None:
+                    observation = observationFunction(observation)
+                # Solicit an action
+                action = self.agents[agentIndex].getAction(observation)
+                self.unmute()
 
             # Execute the action
             self.moveHistory.append((agentIndex, action))
@@ -810,10 +1342,11 @@ class Game:
 
         # inform a learning agent of the game result
         for agentIndex, agent in enumerate(self.agents):
-            if "final" in dir(agent):
+            final = getattr(agent, "final", None)
+            if final != None:
                 try:
                     self.mute(agentIndex)
-                    agent.final(self.state)
+                    final(self.state)
                     self.unmute()
                 except Exception as data:
                     if not self.catchExceptions:
@@ -0,0 +1,419 @@
+# mdpModel.py
+# -----------
+# Strutture dati compilate per il modello MDP usato da MDPAgent
+# (myValueIterationAgents.py).
+
+import hashlib
+import inspect
+import os
+import pickle
+import time
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+TRANSITION_MODEL_CACHE = {}
+
+# Cache su disco dei modelli compilati, una per layout, rumore e codice che
+# costruisce il modello (vedi _builder_digest). Va incrementata
+# MODEL_CACHE_VERSION quando cambia il formato del file.
+USE_DISK_CACHE = True
+MODEL_CACHE_VERSION = 1
+MODEL_CACHE_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "layouts", "compiled"
+)
+
+
+def numpy_available():
+    return np is not None
+
+
+def get_transition_model(layout_text, noise, build, builder=(), arrays=False):
+    """
+    Restituisce il modello di transizione per un layout, costruendolo solo la
+    prima volta. Il modello è condiviso da tutti gli MDPAgent del processo,
+    quindi anche dalle partite successive sullo stesso layout, e salvato su
+    disco (se USE_DISK_CACHE) così che i processi successivi debbano solo
+    caricarlo.
+
+    Args:
+        layout_text (str): Il testo del layout, usato come chiave insieme al rumore.
+        noise (float): La probabilità di scivolare perpendicolarmente.
+        build (callable): Funzione senza argomenti che costruisce il
+            TransitionModel, chiamata solo se il modello non è in cache.
+        builder (iterable): Le funzioni usate da build e i dati da cui
+            dipende il modello (es. gli spostamenti delle azioni): il loro
+            codice (o repr) entra nella chiave della cache su disco, così
+            modificarli non carica un modello compilato con il codice vecchio.
+        arrays (bool): Se compilare anche gli array del backend vettoriale
+            (TransitionModel.arrays), solo per chi usa il backend "numpy".
+            Una volta compilati vengono salvati su disco insieme al modello.
+
+    Returns:
+        (TransitionModel): Il modello compilato.
+    """
+    key = (layout_text, noise)
+    model = TRANSITION_MODEL_CACHE.get(key)
+    if model is None:
+        if USE_DISK_CACHE:
+            model = _load_model(_model_cache_path(layout_text, noise, builder))
+        if model is None:
+            model = build()
+            if USE_DISK_CACHE and not arrays:
+                _save_model(model, _model_cache_path(layout_text, noise, builder))
+        TRANSITION_MODEL_CACHE[key] = model
+    if arrays and model._arrays is None:
+        model.arrays()
+        if USE_DISK_CACHE:
+            _save_model(model, _model_cache_path(layout_text, noise, builder))
+    return model
+
+
+def _model_cache_path(layout_text, noise, builder):
+    """
+    Restituisce il percorso del file di cache per un layout, un rumore e il
+    codice che costruisce il modello.
+    """
+    key = "%d\n%s\n%r\n%s" % (
+        MODEL_CACHE_VERSION,
+        _builder_digest(builder),
+        noise,
+        layout_text,
+    )
+    digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+    return os.path.join(MODEL_CACHE_DIR, digest + ".pkl")
+
+
+def _builder_digest(builder):
+    """
+    Restituisce un hash del codice di TransitionModel e degli oggetti di
+    builder: per le funzioni e le classi il bytecode (vedi _hash_code), per
+    gli altri oggetti la loro repr. Rispetto al sorgente non richiede di
+    rileggere i file, e non cambia se si spostano solo le righe.
+    """
+    digest = hashlib.sha1()
+    for item in (TransitionModel,) + tuple(builder):
+        if inspect.isclass(item):
+            functions = [f for f in vars(item).values() if inspect.isfunction(f)]
+        else:
+            functions = [item]
+        for function in functions:
+            code = getattr(function, "__code__", None)
+            if code is None:
+                digest.update(repr(function).encode("utf-8"))
+            else:
+                _hash_code(code, digest)
+    return digest.hexdigest()
+
+
+def _hash_code(code, digest):
+    """
+    Aggiunge a digest il bytecode, i nomi e le costanti di un code object,
+    comprese le funzioni annidate (lambda, comprehension).
+    """
+    digest.update(code.co_code)
+    digest.update(repr(code.co_names).encode("utf-8"))
+    for const in code.co_consts:
+        if inspect.iscode(const):
+            _hash_code(const, digest)
+        elif isinstance(const, frozenset):
+            # L'ordine dei frozenset dipende dall'hash delle stringhe, che
+            # cambia a ogni processo
+            digest.update(repr(sorted(map(repr, const))).encode("utf-8"))
+        else:
+            digest.update(repr(const).encode("utf-8"))
+
+
+def _load_model(path):
+    """
+    Carica un modello compilato; None se il file manca o non è leggibile
+    (ad esempio se è stato scritto con NumPy e NumPy non è installato).
+    """
+    try:
+        with open(path, "rb") as f:
+            model = pickle.load(f)
+    except (OSError, EOFError, ImportError, AttributeError, pickle.UnpicklingError):
+        return None
+    return model if isinstance(model, TransitionModel) else None
+
+
+def _save_model(model, path):
+    """
+    Salva un modello compilato, completo di predecessori e degli array del
+    backend vettoriale se sono già stati compilati. Gli errori di scrittura
+    vengono ignorati: la cache è solo un'ottimizzazione.
+    """
+    model.predecessors()
+    temp_path = "%s.%d.tmp" % (path, os.getpid())
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(temp_path, "wb") as f:
+            pickle.dump(model, f, pickle.HIGHEST_PROTOCOL)
+        # Rinomina atomica: processi concorrenti non leggono file parziali
+        os.replace(temp_path, path)
+    except OSError:
+        pass
+
+
+class TransitionModel:
+    """
+    Tabella precompilata delle transizioni: per ogni cella e azione la tupla
+    (immutabile) delle coppie (stato successore, probabilità). Contiene anche
+    la geometria statica del layout (muri, dimensioni e angoli).
+    """
+
+    def __init__(self, states, actions, transitions, walls, dimensions, corners):
+        """
+        Args:
+            states (iterable): Le celle calpestabili della mappa.
+            actions (iterable): Le azioni disponibili.
+            transitions (callable): Funzione (state, action) -> lista di coppie
+                (stato successore, probabilità), chiamata solo qui.
+            walls (iterable): Le celle occupate dai muri.
+            dimensions (tuple): Larghezza e altezza della mappa.
+            corners (list): Gli angoli della mappa.
+        """
+        self.walls = frozenset(walls)
+        self.dimensions = tuple(dimensions)
+        self.corners = list(corners)
+        self.states = frozenset(states)
+        self.actions = tuple(actions)
+        self.transitions = {
+            state: {action: tuple(transitions(state, action)) for action in self.actions}
+            for state in self.states
+        }
+        self._predecessors = None
+        self._arrays = None
+
+    def predecessors(self):
+        """
+        Restituisce, per ogni cella, l'insieme delle celle che la possono
+        raggiungere con una transizione del modello.
+
+        Returns:
+            (dict): Dizionario cella -> frozenset dei predecessori.
+        """
+        if self._predecessors is None:
+            predecessors = {}
+            for state, per_action in self.transitions.items():
+                for row in per_action.values():
+                    for next_state, _ in row:
+                        predecessors.setdefault(next_state, set()).add(state)
+            self._predecessors = {
+                state: frozenset(preds) for state, preds in predecessors.items()
+            }
+        return self._predecessors
+
+    def arrays(self):
+        """
+        Compila le transizioni in array NumPy di forma (azioni, slot, celle).
+
+        Returns:
+            (tuple): Celle ordinate, indici dei successori e probabilità.
+        """
+        if self._arrays is None:
+            if np is None:
+                raise Exception("The numpy backend requires NumPy to be installed")
+            states = tuple(sorted(self.states))
+            index = {state: i for i, state in enumerate(states)}
+            slots = max(
+                len(row)
+                for per_action in self.transitions.values()
+                for row in per_action.values()
+            )
+
+            # Gli slot inutilizzati puntano alla cella stessa con probabilità 0
+            n = len(states)
+            successors = np.tile(np.arange(n), (len(self.actions), slots, 1))
+            probs = np.zeros((len(self.actions), slots, n))
+            for a, action in enumerate(self.actions):
+                for i, state in enumerate(states):
+                    for k, (next_state, prob) in enumerate(
+                        self.transitions[state][action]
+                    ):
+                        successors[a, k, i] = index[next_state]
+                        probs[a, k, i] = prob
+            self._arrays = (states, successors, probs)
+        return self._arrays
+
+
+class ArrayBackend:
+    """
+    Backend vettoriale per il Bellman backup di MDPAgent.
+
+    Le celle calpestabili vengono indicizzate una sola volta; reward e valori
+    sono memorizzati in array piatti e, per ogni azione, le transizioni sono
+    compilate in due array (indici dei successori e probabilità) di forma
+    (azioni, slot, celle). Uno sweep di value iteration diventa quindi un
+    gather, un prodotto, una somma e un massimo su array NumPy.
+    """
+
+    def __init__(self, model):
+        """
+        Args:
+            model (TransitionModel): Il modello di transizione (condiviso) da
+                cui prendere gli array compilati.
+        """
+        self.states, self.successors, self.probs = model.arrays()
+        self.index = {state: i for i, state in enumerate(self.states)}
+
+        n = len(self.states)
+        self.rewards = np.zeros(n)
+        self.values = np.zeros(n)
+        self.residual = None
+        self.sweeps = 0
+
+    def set_rewards(self, rewards):
+        """
+        Copia nel vettore dei reward i valori del dizionario cella -> reward.
+        """
+        self.rewards[:] = [rewards[state] for state in self.states]
+
+    def update_rewards(self, rewards, states):
+        """
+        Copia nel vettore dei reward i valori delle sole celle indicate.
+        """
+        for state in states:
+            self.rewards[self.index[state]] = rewards[state]
+
+    def set_values(self, values):
+        """
+        Inizializza i valori a partire da un dizionario cella -> valore.
+        """
+        self.values = np.array([values[state] for state in self.states], dtype=float)
+
+    def sweep(self, discount, region=None):
+        """
+        Esegue uno sweep sincrono (Jacobi) di value iteration.
+
+        Args:
+            discount (float): Il fattore di sconto.
+            region (tuple): Indici, successori e probabilità delle sole celle da
+                aggiornare (vedi solve); None per aggiornare tutte le celle.
+
+        Returns:
+            (float): La massima variazione dei valori nello sweep.
+        """
+        utilities = self.rewards + discount * self.values
+        if region is None:
+            new_values = (self.probs * utilities[self.successors]).sum(axis=1).max(axis=0)
+            delta = float(np.abs(new_values - self.values).max())
+            self.values = new_values
+            return delta
+        cells, successors, probs = region
+        if not len(cells):
+            return 0.0
+        new_values = (probs * utilities[successors]).sum(axis=1).max(axis=0)
+        delta = float(np.abs(new_values - self.values[cells]).max())
+        self.values[cells] = new_values
+        return delta
+
+    def _region(self, states):
+        """
+        Restituisce indici, successori e probabilità delle celle indicate,
+        nel formato atteso da sweep; None se states è None.
+        """
+        if states is None:
+            return None
+        cells = np.array([self.index[state] for state in states], dtype=np.intp)
+        return (cells, self.successors[:, :, cells], self.probs[:, :, cells])
+
+    def solve(self, discount, theta, max_iterations, states=None, deadline=None):
+        """
+        Ripete gli sweep fino alla convergenza o al numero massimo di iterazioni.
+        L'ultima variazione massima resta disponibile in self.residual e il
+        numero di sweep eseguiti in self.sweeps.
+
+        Args:
+            states (iterable): Le celle da aggiornare; None per tutte. Le altre
+                celle mantengono il valore attuale.
+            deadline (float): Istante (time.monotonic) oltre il quale non
+                vengono eseguiti altri sweep; None per nessun limite.
+
+        Returns:
+            (int): L'iterazione in cui la soglia è stata raggiunta, None altrimenti.
+        """
+        region = self._region(states)
+        self.sweeps = 0
+        for i in range(max_iterations):
+            self.residual = self.sweep(discount, region)
+            self.sweeps += 1
+            if self.residual < theta:
+                return i
+            if deadline is not None and time.monotonic() >= deadline:
+                return None
+
+    def value_map(self):
+        """
+        Restituisce i valori come dizionario cella -> valore.
+        """
+        return dict(zip(self.states, self.values.tolist()))
+
+    def solve_policy_iteration(
+        self,
+        discount,
+        theta,
+        max_iterations,
+        eval_sweeps,
+        states=None,
+        deadline=None,
+    ):
+        """
+        Modified policy iteration: un passo di miglioramento greedy seguito da
+        eval_sweeps sweep di valutazione della policy. Con eval_sweeps pari a 0
+        la policy viene valutata esattamente risolvendo (I - discount * P) V = P R
+        (solo sull'intera mappa e con discount < 1).
+
+        Returns:
+            (int): L'iterazione in cui la soglia è stata raggiunta, None altrimenti.
+        """
+        region = self._region(states)
+        if region is None:
+            cells = np.arange(len(self.states))
+            successors, probs = self.successors, self.probs
+        else:
+            cells, successors, probs = region
+        if not len(cells):
+            self.residual = 0.0
+            return 0
+        exact = eval_sweeps == 0 and region is None and discount < 1
+        columns = np.arange(len(cells))
+        self.sweeps = 0
+
+        for i in range(max_iterations):
+            utilities = self.rewards + discount * self.values
+            q_values = (probs * utilities[successors]).sum(axis=1)
+            policy = q_values.argmax(axis=0)
+            new_values = q_values[policy, columns]
+            self.residual = float(np.abs(new_values - self.values[cells]).max())
+            self.values[cells] = new_values
+            self.sweeps += 1
+            if self.residual < theta:
+                return i
+            if deadline is not None and time.monotonic() >= deadline:
+                return None
+
+            # Transizioni della policy corrente: forma (celle, slot)
+            policy_successors = successors[policy, :, columns]
+            policy_probs = probs[policy, :, columns]
+            if exact:
+                transition_matrix = np.zeros((len(cells), len(cells)))
+                np.add.at(
+                    transition_matrix,
+                    (columns[:, None], policy_successors),
+                    policy_probs,
+                )
+                self.values = np.linalg.solve(
+                    np.eye(len(cells)) - discount * transition_matrix,
+                    transition_matrix @ self.rewards,
+                )
+                continue
+            self.sweeps += eval_sweeps
+            for _ in range(eval_sweeps):
+                utilities = self.rewards + discount * self.values
+                self.values[cells] = (
+                    policy_probs * utilities[policy_successors]
+                ).sum(axis=1)
@@ -1,10 +1,15 @@
 from pacman import Directions
 from game import Agent
 import api
+import mdpModel
 import random
 import util
 import sys
-from collections import defaultdict
+import time
+import heapq
+import json
+import os
+from collections import defaultdict, deque
 
 FOOD_REWARD = 10.0
 GHOST_REWARD = -500.0
@@ -17,10 +22,167 @@ SAFETY_DISTANCE = 1
 MAX_ITERATIONS = 500
 NOISE = 0.2
 GHOSTBUSTER_MODE = True
+BACKENDS = ("python", "numpy")
+SOLVERS = ("vi", "mpi")
+EVALUATION_SWEEPS = 5
+# Frazione del tempo concesso dal gioco a una mossa (con -c) riservata alla
+# scelta dell'azione: la soluzione si ferma prima, così la mossa non scade
+DEADLINE_RESERVE = 0.25
+
+
+def _as_bool(value):
+    # Gli argomenti passati con -a arrivano come stringhe ("True", "1")
+    # oppure come 1 se il flag è indicato senza valore.
+    return str(value).lower() in ("1", "true", "yes")
+
+
+class MoveProfiler:
+    """
+    Registra le misure di ogni mossa di MDPAgent su un file CSV o JSONL
+    (scelto in base all'estensione) e ne calcola i percentili a fine partita.
+    """
+
+    FIELDS = (
+        "game",
+        "move",
+        "sweeps",
+        "residual",
+        "rewards_ms",
+        "solve_ms",
+        "select_ms",
+        "total_ms",
+    )
+    TIMINGS = ("rewards_ms", "solve_ms", "select_ms", "total_ms")
+    PERCENTILES = (50, 90, 99, 100)
+
+    def __init__(self, path):
+        self.jsonl = path.endswith(".jsonl")
+        # Niente buffer: con --workers i processi figli ereditano il file e
+        # ogni riga va scritta con un'unica append, senza dati in sospeso
+        self.fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_APPEND)
+        if not self.jsonl:
+            self._write(",".join(self.FIELDS))
+        self.records = []
+
+    def _write(self, line):
+        os.write(self.fd, (line + "\n").encode())
+
+    def record(self, **fields):
+        """
+        Scrive una mossa sul file e la conserva per il riepilogo della partita.
+        """
+        self.records.append(fields)
+        if self.jsonl:
+            self._write(json.dumps(fields))
+        else:
+            self._write(",".join(str(fields[name]) for name in self.FIELDS))
+
+    def summary(self):
+        """
+        Restituisce le righe del riepilogo della partita (percentili dei tempi)
+        e azzera le mosse conservate.
+
+        Returns:
+            (list): Le righe di testo da stampare.
+        """
+        if not self.records:
+            return []
+        header = "".join("%10s" % ("p%d" % p) for p in self.PERCENTILES)
+        lines = ["%-11s" % "ms/mossa" + header]
+        for name in self.TIMINGS:
+            values = sorted(record[name] for record in self.records)
+            lines.append(
+                "%-11s" % name
+                + "".join(
+                    "%10.2f" % values[min(len(values) - 1, len(values) * p // 100)]
+                    for p in self.PERCENTILES
+                )
+            )
+        self.records = []
+        return lines
 
 
 class MDPAgent(Agent):
-    def __init__(self):
+    def __init__(
+        self,
+        backend="python",
+        incremental=False,
+        horizon=0,
+        budget=None,
+        solver="vi",
+        eval_sweeps=EVALUATION_SWEEPS,
+        profile=None,
+        seed=None,
+    ):
+        """
+        Args:
+            backend (str): "python" per la value iteration originale,
+                "numpy" per il backend vettoriale di mdpModel.
+                Si passa da riga di comando con -a backend=numpy.
+            incremental (bool): Se True, dopo la prima mossa i valori del turno
+                precedente vengono aggiornati con prioritized sweeping a partire
+                dalle celle il cui reward è cambiato (-a incremental=True).
+            horizon (int): Se maggiore di 0, la value iteration viene eseguita
+                solo sulle celle a meno di horizon passi da Pacman; le celle a
+                distanza horizon ricevono un valore euristico (-a horizon=10).
+            budget (float): Tempo massimo in millisecondi per mossa. Allo
+                scadere la soluzione si interrompe tra uno sweep e l'altro e
+                si usano i valori ottenuti fino a quel momento (-a budget=50).
+            solver (str): "vi" per la value iteration, "mpi" per la modified
+                policy iteration (-a solver=mpi).
+            eval_sweeps (int): Sweep di valutazione della policy per ogni passo
+                di miglioramento della modified policy iteration. Con il
+                backend numpy, 0 indica la valutazione esatta con un sistema
+                lineare (solo se DISCOUNT_FACTOR < 1).
+            profile (str): Percorso di un file .csv o .jsonl su cui registrare,
+                per ogni mossa, sweep eseguiti, residuo e tempi di
+                aggiornamento dei reward, soluzione e scelta dell'azione; a fine
+                partita vengono stampati i percentili (-a profile=moves.csv).
+            seed: Se indicato, gli scivolamenti del modello di movimento di
+                ogni partita vengono estratti da un api.NoiseSource con questo
+                seme e l'indice della partita, così sono riproducibili senza
+                inizializzare il modulo random (-a seed=42).
+        """
+        if backend not in BACKENDS:
+            raise Exception("Unknown MDPAgent backend: " + str(backend))
+        if backend == "numpy" and not mdpModel.numpy_available():
+            raise Exception("The numpy backend requires NumPy to be installed")
+        self.backend = backend
+        self.array_backend = None
+        self.incremental = _as_bool(incremental)
+        if self.incremental and backend != "python":
+            raise Exception("Incremental value iteration needs the python backend")
+        self.horizon = int(horizon)
+        if self.horizon and self.incremental:
+            raise Exception("Incremental value iteration needs a full-board solve")
+        self.food_positions = set()
+        self.capsule_positions = set()
+        self.base_rewards = None
+        self.reward_stamps = dict()
+        self.rewards_rebuilt = True
+        self.changed_rewards = set()
+        if solver not in SOLVERS:
+            raise Exception("Unknown MDPAgent solver: " + str(solver))
+        self.solver = solver
+        self.eval_sweeps = int(eval_sweeps)
+        self.policy = dict()
+        self.budget = None if budget is None else float(budget) / 1000.0
+        self.deadline = None
+        self.residual = None
+        self.residuals = []
+        self.sweeps = 0
+        self.profiler = None if profile is None else MoveProfiler(profile)
+        self.game_index = -1
+        self.move_index = 0
+        self.seed = seed
+        self.noise_source = None
+        self.transition_model = None
+        self.transitions = None
+        self.predecessors = None
+        self.full_solve_pending = True
+        self.full_solve_backups = 0
+        self.backups_done = 0
+        self.backups_saved = 0
         self.max_iterations = MAX_ITERATIONS
         self.noise = NOISE
         self.ghostbuster_mode = GHOSTBUSTER_MODE
@@ -38,6 +200,18 @@ class MDPAgent(Agent):
             Directions.WEST: (-1, 0),
         }
 
+    def setGameIndex(self, index):
+        """
+        Indica la posizione della prossima partita nella sequenza di partite,
+        per le partite giocate fuori ordine (pacman.py --workers). L'indice
+        determina i campioni di NoiseSource (con seed) e compare nel profilo.
+
+        Args:
+            index (int): L'indice della prossima partita, a partire da 0.
+        """
+        # registerInitialState lo incrementa all'inizio della partita
+        self.game_index = index - 1
+
     def registerInitialState(self, game_state):
         """
         Registra lo stato iniziale del gioco.
@@ -45,6 +219,53 @@ class MDPAgent(Agent):
         Args:
             game_state (GameState): Lo stato iniziale del gioco.
         """
+        # Il modello di transizione dipende solo dal layout e dal rumore: viene
+        # costruito una volta e condiviso tra partite e istanze dell'agente, e
+        # salvato su disco per le esecuzioni successive.
+        self.transition_model = mdpModel.get_transition_model(
+            api.get_layout_text(game_state),
+            self.noise,
+            lambda: self._build_transition_model(game_state),
+            builder=(
+                self._build_transition_model,
+                self.__get_transition_states_and_probs,
+                self._next_state,
+                self.move_offsets,
+            ),
+            arrays=self.backend == "numpy",
+        )
+        self.corners = list(self.transition_model.corners)
+        self.map_width, self.map_height = self.transition_model.dimensions
+        self.wall_positions = self.transition_model.walls
+        self.legal_states = self.transition_model.states
+        self.transitions = self.transition_model.transitions
+        if self.backend == "numpy":
+            self.array_backend = mdpModel.ArrayBackend(self.transition_model)
+            self.array_backend.set_values(self.values)
+        # La mappa dei reward viene ricostruita per intero alla prima mossa
+        self.base_rewards = None
+        if self.incremental:
+            self.predecessors = self.transition_model.predecessors()
+            # La prima mossa di ogni partita esegue sempre una soluzione completa
+            self.full_solve_pending = True
+            self.backups_done = 0
+            self.backups_saved = 0
+        self.residuals = []
+        self.game_index += 1
+        self.move_index = 0
+        if self.seed is not None:
+            self.noise_source = api.NoiseSource(self.seed, self.game_index)
+
+    def _build_transition_model(self, game_state):
+        """
+        Costruisce il modello di transizione a partire dai muri del layout.
+
+        Args:
+            game_state (GameState): Lo stato iniziale del gioco.
+
+        Returns:
+            (TransitionModel): Il modello compilato.
+        """
         self.corners = api.get_corners(game_state)
         self.map_width, self.map_height = api.get_map_dimensions(game_state)
         # Uso frozenset per evitare che il set venga modificato
@@ -58,23 +279,292 @@ class MDPAgent(Agent):
             for y in range(self.map_height)
             if (x, y) not in self.wall_positions
         )
+        return mdpModel.TransitionModel(
+            self.legal_states,
+            self.move_offsets,
+            self.__get_transition_states_and_probs,
+            self.wall_positions,
+            (self.map_width, self.map_height),
+            self.corners,
+        )
 
     def final(self, game_state):
         # Numero di iterazioni effettuate
         # print("Il gioco è finito")
         # print("Punteggio: ", game_state.getScore())
-        pass
+        if self.incremental:
+            print(
+                "Backup eseguiti: %d, risparmiati: %d"
+                % (self.backups_done, self.backups_saved)
+            )
+        if self.budget is not None and self.residuals:
+            print(
+                "Residuo medio: %.6f, massimo: %.6f"
+                % (sum(self.residuals) / len(self.residuals), max(self.residuals))
+            )
+        if self.profiler is not None:
+            for line in self.profiler.summary():
+                print(line)
+
+    def _out_of_time(self):
+        """
+        Returns:
+            (bool): True se il budget della mossa corrente è esaurito.
+        """
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    def solve(self, states=None):
+        """
+        Risolve l'MDP con il solver scelto (value iteration o modified policy
+        iteration).
+
+        Args:
+            states (iterable): Le celle da aggiornare; se None tutte le celle
+                calpestabili.
 
-    def value_iteration(self):
+        Returns:
+            (int): L'iterazione in cui la soglia è stata raggiunta, None altrimenti.
+        """
+        if self.solver == "mpi":
+            return self.policy_iteration(states)
+        return self.value_iteration(states)
+
+    def value_iteration(self, states=None):
+        """
+        Esegue la value iteration fino alla convergenza.
+
+        Args:
+            states (iterable): Le celle da aggiornare; se None tutte le celle
+                calpestabili. Le altre celle mantengono il valore attuale.
+
+        Returns:
+            (int): L'iterazione in cui la soglia è stata raggiunta, None altrimenti.
+        """
+        if self.array_backend is not None:
+            return self._array_value_iteration(states)
+        if states is None:
+            states = self.legal_states
         for i in range(self.max_iterations):
             delta = 0
-            for state in self.legal_states:
+            for state in states:
                 state_value = self.values[state]
                 self.values[state] = self._get_best_policy(state)
                 delta = max(delta, abs(state_value - self.values[state]))
+            self.residual = delta
+            self.sweeps = i + 1
             if delta < THETA:
                 # print(" ha superato la soglia con  iterazioni : ", i)
                 return i
+            if self._out_of_time():
+                return None
+
+    def policy_iteration(self, states=None):
+        """
+        Modified policy iteration sullo stesso modello della value iteration.
+
+        Ogni iterazione esegue un passo di miglioramento greedy (equivalente a
+        uno sweep di value iteration che memorizza anche l'azione migliore) e
+        poi self.eval_sweeps sweep di valutazione della policy, che calcolano
+        un solo Q-value per cella. Si ferma quando il passo di miglioramento
+        cambia i valori meno di THETA: il punto fisso è quello della value
+        iteration, quindi l'azione scelta è la stessa.
+
+        Args:
+            states (iterable): Le celle da aggiornare; se None tutte le celle
+                calpestabili.
+
+        Returns:
+            (int): L'iterazione in cui la soglia è stata raggiunta, None altrimenti.
+        """
+        if self.array_backend is not None:
+            return self._array_value_iteration(states, policy_iteration=True)
+        if states is None:
+            states = self.legal_states
+        self.sweeps = 0
+        for i in range(self.max_iterations):
+            delta = 0
+            for state in states:
+                q_values = {
+                    action: self.__compute_q_value_from_values(state, action)
+                    for action in self.move_offsets
+                }
+                action = max(q_values, key=q_values.get)
+                state_value = self.values[state]
+                self.policy[state] = action
+                self.values[state] = q_values[action]
+                delta = max(delta, abs(state_value - self.values[state]))
+            self.residual = delta
+            self.sweeps += 1
+            if delta < THETA:
+                return i
+            if self._out_of_time():
+                return None
+            self.sweeps += self.eval_sweeps
+            for _ in range(self.eval_sweeps):
+                for state in states:
+                    self.values[state] = self.__compute_q_value_from_values(
+                        state, self.policy[state]
+                    )
+
+    def _incremental_value_iteration(self, changed):
+        """
+        Aggiorna i valori del turno precedente con prioritized sweeping.
+
+        Solo i predecessori delle celle il cui reward è cambiato vengono messi
+        in coda, con priorità pari al loro errore di Bellman; ogni cella
+        aggiornata rimette in coda i propri predecessori. La prima mossa della
+        partita esegue una value iteration completa, il cui numero di backup
+        (sweep * celle) è la stima usata per contare i backup risparmiati.
+
+        Args:
+            changed (iterable): Le celle il cui reward è cambiato dal turno
+                precedente, come restituite da _update_rewards.
+
+        Returns:
+            (int): Il numero di backup eseguiti.
+        """
+        if self.full_solve_pending:
+            iterations = self.solve()
+            sweeps = self.max_iterations if iterations is None else iterations + 1
+            backups = sweeps * len(self.legal_states)
+            self.full_solve_backups = backups
+            self.full_solve_pending = False
+        else:
+            backups = self._prioritized_sweeping(changed)
+            self.backups_saved += max(0, self.full_solve_backups - backups)
+        self.backups_done += backups
+        return backups
+
+    def _prioritized_sweeping(self, changed):
+        """
+        Propaga gli aggiornamenti a partire dalle celle indicate.
+
+        Args:
+            changed (iterable): Le celle il cui reward è cambiato.
+
+        Returns:
+            (int): Il numero di backup (valutazioni di _get_best_policy) eseguiti.
+        """
+        queue = []
+        backups = 0
+        seeds = set()
+        for state in changed:
+            seeds.update(self.predecessors.get(state, ()))
+        for state in seeds:
+            error = abs(self._get_best_policy(state) - self.values[state])
+            backups += 1
+            if error >= THETA:
+                heapq.heappush(queue, (-error, state))
+
+        max_backups = self.max_iterations * len(self.legal_states)
+        # Il tempo viene controllato ogni 256 backup: backups cresce di più
+        # di uno per iterazione, quindi serve una soglia e non un modulo
+        next_check = backups + 256
+        while queue and backups < max_backups:
+            if backups >= next_check:
+                if self._out_of_time():
+                    break
+                next_check = backups + 256
+            _, state = heapq.heappop(queue)
+            new_value = self._get_best_policy(state)
+            backups += 1
+            if abs(new_value - self.values[state]) < THETA:
+                # Voce obsoleta: la cella è già stata aggiornata
+                continue
+            self.values[state] = new_value
+            for predecessor in self.predecessors.get(state, ()):
+                error = abs(self._get_best_policy(predecessor) - self.values[predecessor])
+                backups += 1
+                if error >= THETA:
+                    heapq.heappush(queue, (-error, predecessor))
+        # Le voci rimaste in coda possono essere obsolete: è un limite superiore
+        self.residual = -queue[0][0] if queue else 0.0
+        # Sweep equivalenti, per confrontarli con la soluzione completa
+        self.sweeps = backups / float(len(self.legal_states))
+        return backups
+
+    def _array_value_iteration(self, states=None, policy_iteration=False):
+        """
+        Value iteration (o modified policy iteration) sul backend vettoriale.
+        I valori ottenuti vengono ricopiati in self.values, così la scelta
+        dell'azione resta identica.
+        """
+        if self.rewards_rebuilt:
+            self.array_backend.set_rewards(self.rewards)
+        else:
+            self.array_backend.update_rewards(self.rewards, self.changed_rewards)
+        if states is not None:
+            # I valori di bordo sono stati scritti in self.values
+            self.array_backend.set_values(self.values)
+        if policy_iteration:
+            iterations = self.array_backend.solve_policy_iteration(
+                DISCOUNT_FACTOR,
+                THETA,
+                self.max_iterations,
+                self.eval_sweeps,
+                states,
+                self.deadline,
+            )
+        else:
+            iterations = self.array_backend.solve(
+                DISCOUNT_FACTOR, THETA, self.max_iterations, states, self.deadline
+            )
+        self.residual = self.array_backend.residual
+        self.sweeps = self.array_backend.sweeps
+        self.values.update(self.array_backend.value_map())
+        return iterations
+
+    def _horizon_value_iteration(self, pacman_pos):
+        """
+        Value iteration limitata alla regione entro self.horizon passi da Pacman.
+
+        Le celle a distanza esattamente self.horizon formano il bordo della
+        regione: il loro valore è fissato all'euristica FOOD_REWARD *
+        DISCOUNT_FACTOR ** d, dove d è la distanza nel labirinto dal cibo più
+        vicino, e la value iteration aggiorna solo le celle interne.
+
+        Args:
+            pacman_pos (tuple): La posizione di Pacman.
+
+        Returns:
+            (int): L'iterazione in cui la soglia è stata raggiunta, None altrimenti.
+        """
+        depths = self._maze_distances([pacman_pos], self.horizon)
+        food_distances = self._maze_distances(self.food_positions)
+        interior = []
+        for state, depth in depths.items():
+            if depth < self.horizon:
+                interior.append(state)
+            elif state in food_distances:
+                self.values[state] = FOOD_REWARD * DISCOUNT_FACTOR ** food_distances[state]
+            else:
+                self.values[state] = 0.0
+        return self.solve(interior)
+
+    def _maze_distances(self, sources, limit=None):
+        """
+        Visita in ampiezza del labirinto a partire da più sorgenti.
+
+        Args:
+            sources (iterable): Le celle di partenza (distanza 0).
+            limit (int): La distanza massima da esplorare; None per nessun limite.
+
+        Returns:
+            (dict): Dizionario cella -> distanza dalla sorgente più vicina.
+        """
+        distances = {source: 0 for source in sources}
+        frontier = deque(distances)
+        while frontier:
+            x, y = frontier.popleft()
+            depth = distances[(x, y)]
+            if depth == limit:
+                continue
+            for dx, dy in self.move_offsets.values():
+                neighbour = (x + dx, y + dy)
+                if neighbour in self.legal_states and neighbour not in distances:
+                    distances[neighbour] = depth + 1
+                    frontier.append(neighbour)
+        return distances
 
     def _get_best_policy(self, state):
         """
@@ -107,9 +597,7 @@ class MDPAgent(Agent):
         return sum(
             prob
             * (self.rewards[next_state] + DISCOUNT_FACTOR * self.values[next_state])
-            for next_state, prob in self.__get_transition_states_and_probs(
-                state, action
-            )
+            for next_state, prob in self.transitions[state][action]
         )
 
     def _next_state(self, state, offset):
@@ -129,6 +617,7 @@ class MDPAgent(Agent):
     def __get_transition_states_and_probs(self, state, action):
         """
         Dato una stato attuale e l'azione da intraprendere restituisce gli stati successori e le probabilità di transizione.
+        Viene chiamata solo per costruire la tabella condivisa di mdpModel.TransitionModel.
 
         Args:
             state (tuple): Lo stato attuale.
@@ -168,17 +657,104 @@ class MDPAgent(Agent):
         """
         Aggiorna i reward per ogni stato in base allo stato attuale del gioco.
 
+        Alla prima mossa della partita la mappa viene ricostruita per intero;
+        nei turni successivi vengono toccate solo le celle cambiate: il cibo o
+        la capsula sotto Pacman (l'unica cella in cui possono sparire) e le
+        celle marcate dai fantasmi e dalle zone di pericolo, vecchie e nuove.
+        Con visibilità parziale il cibo visibile cambia a ogni turno, quindi
+        la mappa viene sempre ricostruita.
+
         Args:
             game_state (GameState): Lo stato attuale del gioco.
+
+        Returns:
+            (set): Le celle il cui reward è cambiato.
+        """
+        self.rewards_rebuilt = self.base_rewards is None or api.partialVisibility
+        if self.rewards_rebuilt:
+            changed = self._rebuild_rewards(game_state)
+        else:
+            changed = self._update_changed_rewards(game_state)
+        self.changed_rewards = changed
+        return changed
+
+    def _rebuild_rewards(self, game_state):
         """
-        food_positions = set(api.get_food(game_state))
-        capsule_positions = set(api.get_capsules(game_state))
-        ghost_positions = set(api.get_ghosts(game_state))
+        Ricostruisce la mappa dei reward leggendo cibo e capsule dallo stato.
+
+        Args:
+            game_state (GameState): Lo stato attuale del gioco.
+
+        Returns:
+            (set): Le celle il cui reward è cambiato.
+        """
+        observation = api.observe(game_state)
+        self.food_positions = set(observation.food)
+        self.capsule_positions = set(observation.capsules)
+
+        self.base_rewards = dict.fromkeys(self.legal_states, BLANK_REWARD)
+        self.base_rewards.update({pos: FOOD_REWARD for pos in self.food_positions})
+        self.base_rewards.update(
+            {pos: CAPSULE_REWARD for pos in self.capsule_positions}
+        )
+        self.reward_stamps = self._ghost_reward_stamps(game_state)
+
+        changed = set()
+        for state, base_reward in self.base_rewards.items():
+            reward = self.reward_stamps.get(state, base_reward)
+            if self.rewards.get(state) != reward:
+                self.rewards[state] = reward
+                changed.add(state)
+        return changed
+
+    def _update_changed_rewards(self, game_state):
+        """
+        Aggiorna solo le celle il cui reward può essere cambiato dall'ultima
+        osservazione.
+
+        Args:
+            game_state (GameState): Lo stato attuale del gioco.
+
+        Returns:
+            (set): Le celle il cui reward è cambiato.
+        """
+        pacman_pos = api.whereAmI(game_state)
+        candidates = set(self.reward_stamps)
+        if pacman_pos in self.food_positions or pacman_pos in self.capsule_positions:
+            self.food_positions.discard(pacman_pos)
+            self.capsule_positions.discard(pacman_pos)
+            self.base_rewards[pacman_pos] = BLANK_REWARD
+            candidates.add(pacman_pos)
+
+        self.reward_stamps = self._ghost_reward_stamps(game_state)
+        candidates.update(self.reward_stamps)
+
+        changed = set()
+        for state in candidates:
+            reward = self.reward_stamps.get(state, self.base_rewards[state])
+            if self.rewards[state] != reward:
+                self.rewards[state] = reward
+                changed.add(state)
+        return changed
+
+    def _ghost_reward_stamps(self, game_state):
+        """
+        Calcola i reward dei fantasmi e delle zone di pericolo, che si
+        sovrappongono a quelli di cibo, capsule e celle vuote.
+
+        Args:
+            game_state (GameState): Lo stato attuale del gioco.
+
+        Returns:
+            (dict): Dizionario cella -> reward per le sole celle marcate.
+        """
+        observation = api.observe(game_state)
+        ghost_positions = set(observation.ghosts)
 
         danger_zones = set(
             api.get_danger_zones(
                 game_state,
-                api.whereAmI(game_state),
+                observation.pacman,
                 ghost_positions,
                 self.map_width,
                 self.map_height,
@@ -186,14 +762,6 @@ class MDPAgent(Agent):
             )
         )
 
-        blank_positions = (
-            self.legal_states
-            - food_positions
-            - capsule_positions
-            - ghost_positions
-            - danger_zones
-        )
-
         ghost_reward, danger_reward = GHOST_REWARD, DANGER_ZONE_REWARD
 
         if self.ghostbuster_mode:
@@ -201,22 +769,83 @@ class MDPAgent(Agent):
                 game_state, GHOST_REWARD, DANGER_ZONE_REWARD
             )
 
-        self.rewards.update({pos: FOOD_REWARD for pos in food_positions})
-        # self.previous_foods = food_positions
-        self.rewards.update({pos: CAPSULE_REWARD for pos in capsule_positions})
-        self.rewards.update({pos: ghost_reward for pos in ghost_positions})
-        self.rewards.update({pos: danger_reward for pos in danger_zones})
-        self.rewards.update({pos: BLANK_REWARD for pos in blank_positions})
+        # Le zone di pericolo hanno la precedenza sui fantasmi
+        stamps = {pos: ghost_reward for pos in ghost_positions}
+        stamps.update({pos: danger_reward for pos in danger_zones})
+        return {pos: r for pos, r in stamps.items() if pos in self.legal_states}
 
     def getAction(self, game_state):
-        self._update_rewards(game_state)
-        self.value_iteration()
-        pacman_pos = api.whereAmI(game_state)
-        legal_actions = api.legalActions(game_state)
+        self.deadline = None
+        if self.budget is not None:
+            self.deadline = time.monotonic() + self.budget
+        # Con -c il gioco impone il proprio limite di tempo alla mossa; una
+        # parte viene lasciata alla scelta dell'azione
+        game_deadline = util.currentDeadline()
+        if game_deadline is not None:
+            solve_end = time.monotonic() + (1 - DEADLINE_RESERVE) * (
+                game_deadline.remaining()
+            )
+            if self.deadline is None or solve_end < self.deadline:
+                self.deadline = solve_end
+        if self.profiler is None:
+            changed = self._update_rewards(game_state)
+            self._solve_move(game_state, changed)
+            return self._select_action(game_state)
+
+        start = time.perf_counter()
+        changed = self._update_rewards(game_state)
+        rewards_done = time.perf_counter()
+        self._solve_move(game_state, changed)
+        solve_done = time.perf_counter()
+        action = self._select_action(game_state)
+        end = time.perf_counter()
+        self.profiler.record(
+            game=self.game_index,
+            move=self.move_index,
+            sweeps=self.sweeps,
+            residual=self.residual,
+            rewards_ms=1000 * (rewards_done - start),
+            solve_ms=1000 * (solve_done - rewards_done),
+            select_ms=1000 * (end - solve_done),
+            total_ms=1000 * (end - start),
+        )
+        self.move_index += 1
+        return action
+
+    def _solve_move(self, game_state, changed):
+        """
+        Aggiorna i valori per la mossa corrente con la modalità scelta.
+
+        Args:
+            game_state (GameState): Lo stato attuale del gioco.
+            changed (set): Le celle il cui reward è cambiato.
+        """
+        if self.incremental:
+            self._incremental_value_iteration(changed)
+        elif self.horizon:
+            self._horizon_value_iteration(api.whereAmI(game_state))
+        else:
+            self.solve()
+        if self.budget is not None and self.residual is not None:
+            self.residuals.append(self.residual)
+
+    def _select_action(self, game_state):
+        """
+        Sceglie l'azione con il Q-value più alto nella posizione di Pacman.
+
+        Args:
+            game_state (GameState): Lo stato attuale del gioco.
+
+        Returns:
+            (str): L'azione da eseguire, passata al modello di movimento di api.
+        """
+        observation = api.observe(game_state)
+        pacman_pos = observation.pacman
+        legal_actions = list(observation.legal_actions)
         legal_actions.remove(Directions.STOP)
 
         best_action = max(
             legal_actions,
             key=lambda action: self.__compute_q_value_from_values(pacman_pos, action),
         )
-        return api.makeMove(best_action, legal_actions)
+        return api.makeMove(best_action, legal_actions, self.noise_source)
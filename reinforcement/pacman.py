@@ -43,6 +43,8 @@ from game import GameStateData
 from game import Game
 from game import Directions
 from game import Actions
+from game import Configuration
+from game import stateDataFromBytes
 from util import nearestPoint
 from util import manhattanDistance
 import util, layout
@@ -72,13 +74,21 @@ class GameState:
     # Accessor methods: use these to access state data #
     ####################################################
 
-    # static variable keeps track of which states have had getLegalActions called
-    explored = set()
+    # static variable: an ExplorationStats that accounts for the states
+    # generated by generateSuccessor, or None (the default) for no accounting
+    exploration = None
 
     def getAndResetExplored():
-        tmp = GameState.explored.copy()
-        GameState.explored = set()
-        return tmp
+        """
+        Returns the states sampled by GameState.exploration (an empty set if
+        there is no accounting or no sample) and resets the accounting.
+        """
+        stats = GameState.exploration
+        if stats == None:
+            return set()
+        explored = stats.sampledStates()
+        stats.reset()
+        return explored
 
     getAndResetExplored = staticmethod(getAndResetExplored)
 
@@ -86,7 +96,6 @@ class GameState:
         """
         Returns the legal actions for the agent specified.
         """
-        #        GameState.explored.add(self)
         if self.isWin() or self.isLose():
             return []
 
@@ -108,7 +117,10 @@ class GameState:
 
         # Let agent's logic deal with its action's effects on the board
         if agentIndex == 0:  # Pacman is moving
-            state.data._eaten = [False for i in range(state.getNumAgents())]
+            # Only replaced (not cleared in place) after a ghost was eaten,
+            # since the list is shared with the predecessor
+            if True in state.data._eaten:
+                state.data._eaten = [False for i in range(state.getNumAgents())]
             PacmanRules.applyAction(state, action)
         else:  # A ghost is moving
             GhostRules.applyAction(state, action, agentIndex)
@@ -117,7 +129,7 @@ class GameState:
         if agentIndex == 0:
             state.data.scoreChange += -TIME_PENALTY  # Penalty for waiting around
         else:
-            GhostRules.decrementTimer(state.data.agentStates[agentIndex])
+            GhostRules.decrementTimer(state.data.getMutableAgentState(agentIndex))
 
         # Resolve multi-agent effects
         GhostRules.checkDeath(state, agentIndex)
@@ -125,8 +137,9 @@ class GameState:
         # Book keeping
         state.data._agentMoved = agentIndex
         state.data.score += state.data.scoreChange
-        GameState.explored.add(self)
-        GameState.explored.add(state)
+        state.data.updateHash(agentIndex)
+        if GameState.exploration != None:
+            GameState.exploration.record(self, state, agentIndex)
         return state
 
     def getLegalPacmanActions(self):
@@ -151,12 +164,20 @@ class GameState:
         return self.data.agentStates[0].getPosition()
 
     def getGhostStates(self):
-        return self.data.agentStates[1:]
+        # Agent states can be shared with other states: see getGhostState
+        return [
+            self.data.getMutableAgentState(i) for i in range(1, self.getNumAgents())
+        ]
 
     def getGhostState(self, agentIndex):
+        """
+        Returns the AgentState of a ghost.  It is this state's own copy, so
+        changing it does not affect the states it was generated from (or the
+        game, for a snapshot).
+        """
         if agentIndex == 0 or agentIndex >= self.getNumAgents():
             raise Exception("Invalid index passed to getGhostState")
-        return self.data.agentStates[agentIndex]
+        return self.data.getMutableAgentState(agentIndex)
 
     def getGhostPosition(self, agentIndex):
         if agentIndex == 0:
@@ -164,7 +185,7 @@ class GameState:
         return self.data.agentStates[agentIndex].getPosition()
 
     def getGhostPositions(self):
-        return [s.getPosition() for s in self.getGhostStates()]
+        return [s.getPosition() for s in self.data.agentStates[1:]]
 
     def getNumAgents(self):
         return len(self.data.agentStates)
@@ -239,6 +260,35 @@ class GameState:
         state.data = self.data.deepCopy()
         return state
 
+    def snapshot(self):
+        """
+        Returns a cheap copy of the state for agents to observe: unlike
+        deepCopy, the food grid and agent states are shared with this state
+        and only copied when they are first changed, by the rules or through
+        getFood and getGhostState(s), so nothing done to the snapshot or its
+        successors affects this state.
+        """
+        state = GameState.__new__(GameState)
+        state.data = self.data.snapshot()
+        return state
+
+    def toBytes(self):
+        """
+        Returns the state in a compact binary format, e.g. to send it to
+        another process; see GameStateData.toBytes.
+        """
+        return self.data.toBytes()
+
+    def fromBytes(data, layout):
+        """
+        Rebuilds a state on the given layout from the output of toBytes.
+        """
+        state = GameState.__new__(GameState)
+        state.data = stateDataFromBytes(data, layout)
+        return state
+
+    fromBytes = staticmethod(fromBytes)
+
     def __eq__(self, other):
         """
         Allows two states to be compared.
@@ -344,6 +394,74 @@ class ClassicGameRules:
         return 0
 
 
+class ExplorationStats:
+    """
+    Opt-in accounting of the states generated by GameState.generateSuccessor,
+    in bounded memory.  Turn it on by setting GameState.exploration to an
+    instance, and off by setting it back to None.
+
+    It always counts the successors generated, overall and per agent.  With
+    distinct=True it also estimates the number of distinct states (parents
+    and successors) with a HyperLogLog, which costs one state hash per state.
+    With sampleSize > 0 it keeps a uniform sample of that many successors.
+    """
+
+    def __init__(self, distinct=False, sampleSize=0, precision=12, seed=None):
+        self.distinct = distinct
+        self.sampleSize = sampleSize
+        self.precision = precision
+        self.seed = seed
+        self.reset()
+
+    def reset(self):
+        self.successors = 0
+        self.successorsByAgent = []
+        self.distinctStates = None
+        if self.distinct:
+            self.distinctStates = util.HyperLogLog(self.precision)
+        self.sample = None
+        if self.sampleSize > 0:
+            self.sample = util.ReservoirSample(self.sampleSize, self.seed)
+
+    def record(self, state, successor, agentIndex):
+        self.successors += 1
+        byAgent = self.successorsByAgent
+        while len(byAgent) <= agentIndex:
+            byAgent.append(0)
+        byAgent[agentIndex] += 1
+        if self.distinctStates != None:
+            self.distinctStates.add(state)
+            self.distinctStates.add(successor)
+        if self.sample != None:
+            self.sample.add(successor)
+
+    def estimatedDistinctStates(self):
+        """
+        Returns the estimated number of distinct states seen, or None if
+        distinct states are not being counted.
+        """
+        if self.distinctStates == None:
+            return None
+        return self.distinctStates.count()
+
+    def sampledStates(self):
+        "Returns the set of sampled successors (empty without a sample)"
+        if self.sample == None:
+            return set()
+        return set(self.sample.items)
+
+    def __str__(self):
+        out = "Successors generated: %d (per agent: %s)" % (
+            self.successors,
+            ", ".join([str(n) for n in self.successorsByAgent]),
+        )
+        if self.distinctStates != None:
+            out += "\nDistinct states (estimate): %d" % self.estimatedDistinctStates()
+        if self.sample != None:
+            out += "\nSampled states: %d" % len(self.sample.items)
+        return out
+
+
 class PacmanRules:
     """
     These functions govern how pacman interacts with his environment under
@@ -357,7 +475,7 @@ class PacmanRules:
         Returns a list of possible actions.
         """
         return Actions.getPossibleActions(
-            state.getPacmanState().configuration, state.data.layout.walls
+            state.data.agentStates[0].configuration, state.data.layout.walls
         )
 
     getLegalActions = staticmethod(getLegalActions)
@@ -370,7 +488,7 @@ class PacmanRules:
         if action not in legal:
             raise Exception("Illegal action " + str(action))
 
-        pacmanState = state.data.agentStates[0]
+        pacmanState = state.data.getMutableAgentState(0)
 
         # Update Configuration
         vector = Actions.directionToVector(action, PacmanRules.PACMAN_SPEED)
@@ -404,7 +522,7 @@ class PacmanRules:
             state.data._capsuleEaten = position
             # Reset all ghosts' scared timers
             for index in range(1, len(state.data.agentStates)):
-                state.data.agentStates[index].scaredTimer = SCARED_TIME
+                state.data.getMutableAgentState(index).scaredTimer = SCARED_TIME
 
     consume = staticmethod(consume)
 
@@ -421,7 +539,7 @@ class GhostRules:
         Ghosts cannot stop, and cannot turn around unless they
         reach a dead end, but can turn 90 degrees at intersections.
         """
-        conf = state.getGhostState(ghostIndex).configuration
+        conf = state.data.agentStates[ghostIndex].configuration
         possibleActions = Actions.getPossibleActions(conf, state.data.layout.walls)
         reverse = Actions.reverseDirection(conf.direction)
         if Directions.STOP in possibleActions:
@@ -438,7 +556,7 @@ class GhostRules:
         if action not in legal:
             raise Exception("Illegal ghost action " + str(action))
 
-        ghostState = state.data.agentStates[ghostIndex]
+        ghostState = state.data.getMutableAgentState(ghostIndex)
         speed = GhostRules.GHOST_SPEED
         if ghostState.scaredTimer > 0:
             speed /= 2.0
@@ -450,7 +568,10 @@ class GhostRules:
     def decrementTimer(ghostState):
         timer = ghostState.scaredTimer
         if timer == 1:
-            ghostState.configuration.pos = nearestPoint(ghostState.configuration.pos)
+            configuration = ghostState.configuration
+            ghostState.configuration = Configuration(
+                nearestPoint(configuration.pos), configuration.direction
+            )
         ghostState.scaredTimer = max(0, timer - 1)
 
     decrementTimer = staticmethod(decrementTimer)
@@ -474,9 +595,11 @@ class GhostRules:
     def collide(state, ghostState, agentIndex):
         if ghostState.scaredTimer > 0:
             state.data.scoreChange += 200
+            ghostState = state.data.getMutableAgentState(agentIndex)
             GhostRules.placeGhost(state, ghostState)
             ghostState.scaredTimer = 0
             # Added for first-person
+            state.data._eaten = state.data._eaten[:]
             state.data._eaten[agentIndex] = True
         else:
             if not state.data._win:
@@ -654,14 +777,27 @@ def readCommand(argv):
     parser.add_option(
         "--timeout",
         dest="timeout",
-        type="int",
+        type="float",
         help=default(
             "Maximum length of time an agent can spend computing in a single game"
         ),
         default=30,
     )
+    parser.add_option(
+        "--workers",
+        dest="workers",
+        type="int",
+        help="Number of processes playing the test games in parallel (needs -q). "
+        "The results only depend on the seed (-f), not on the number",
+        default=None,
+    )
 
     options, otherjunk = parser.parse_args(argv)
+    if options.workers != None:
+        if options.workers < 1:
+            raise Exception("--workers needs at least one worker")
+        if not options.quietGraphics:
+            raise Exception("Playing games in parallel (--workers) requires -q")
     if len(otherjunk) != 0:
         raise Exception("Command line input not understood: " + str(otherjunk))
     args = dict()
@@ -717,6 +853,7 @@ def readCommand(argv):
     args["record"] = options.record
     args["catchExceptions"] = options.catchExceptions
     args["timeout"] = options.timeout
+    args["workers"] = options.workers
 
     # Special case: recorded games don't use the runGames method or args structure
     if options.gameToReplay != None:
@@ -784,6 +921,127 @@ def replayGame(layout, actions, display):
     display.finish()
 
 
+def recordGame(layout, actions, index):
+    import time
+    import _pickle as cPickle
+
+    fname = ("recorded-game-%d" % index) + "-".join(
+        [str(t) for t in time.localtime()[1:6]]
+    )
+    f = open(fname, "w")
+    components = {"layout": layout, "actions": actions}
+    cPickle.dump(components, f)
+    f.close()
+
+
+class GameRecord:
+    """
+    What runGames keeps of a game played by a worker process: the final state,
+    the move history and whether an agent timed out or crashed.
+    """
+
+    def __init__(self, state, moveHistory, agentTimeout, agentCrashed):
+        self.state = state
+        self.moveHistory = moveHistory
+        self.agentTimeout = agentTimeout
+        self.agentCrashed = agentCrashed
+
+
+# The layout, agents and rules of the games played by a worker process
+_WORKER_GAMES = None
+
+
+def _initWorker(games):
+    global _WORKER_GAMES
+    _WORKER_GAMES = games
+
+
+def _freshWorkerGame():
+    """
+    Returns a copy of the worker's games, with the agents as the parent
+    process left them, so that no game sees the state (values, rewards, ...)
+    that earlier games of the same worker left in its agents.
+    """
+    import copy
+
+    return copy.deepcopy(_WORKER_GAMES)
+
+
+def _playWorkerGame(task):
+    """
+    Plays one test game in a worker process and returns the final state (in
+    binary form) and the outcome.  The task is the index of the game in
+    runGames, passed on to agents that define setGameIndex, and the seed for
+    the random module.
+    """
+    import textDisplay
+
+    index, seed = task
+    layout, pacman, ghosts, catchExceptions, timeout = _freshWorkerGame()
+    random.seed(seed)
+    for agent in [pacman] + ghosts:
+        setGameIndex = getattr(agent, "setGameIndex", None)
+        if setGameIndex != None:
+            setGameIndex(index)
+    rules = ClassicGameRules(timeout)
+    game = rules.newGame(
+        layout, pacman, ghosts, textDisplay.NullGraphics(), False, catchExceptions
+    )
+    game.run()
+    return (
+        game.state.toBytes(),
+        game.moveHistory,
+        game.agentTimeout,
+        game.agentCrashed,
+    )
+
+
+def runParallelGames(
+    layout,
+    pacman,
+    ghosts,
+    numGames,
+    catchExceptions,
+    timeout,
+    workers,
+    firstIndex=0,
+):
+    """
+    Plays numGames test games without graphics on a pool of worker processes
+    and returns a GameRecord for each, in order.
+
+    Each game starts from its own seed, drawn from the random module, so the
+    games are reproducible when the random module is seeded (-f).  Agents
+    that keep per-game state of their own (e.g. a game counter) can define
+    setGameIndex: it is called with the index of each game, counting from
+    firstIndex, before the game starts.  Where
+    possible the workers are forked, so they get the agents as they are now
+    (e.g. after training) without pickling them; otherwise the agents must
+    be picklable.  Every game is played with a fresh copy of the agents, so
+    nothing they learn in a test game reaches another game, and the results
+    do not depend on the number of workers.
+    """
+    import multiprocessing
+
+    tasks = [(firstIndex + i, random.getrandbits(64)) for i in range(numGames)]
+    if "fork" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("fork")
+    else:
+        context = multiprocessing.get_context()
+    games = (layout, pacman, ghosts, catchExceptions, timeout)
+    sys.stdout.flush()
+    pool = context.Pool(min(workers, numGames), _initWorker, (games,))
+    try:
+        results = pool.map(_playWorkerGame, tasks, chunksize=1)
+    finally:
+        pool.terminate()
+        pool.join()
+    return [
+        GameRecord(GameState.fromBytes(state, layout), moveHistory, timedOut, crashed)
+        for state, moveHistory, timedOut, crashed in results
+    ]
+
+
 def runGames(
     layout,
     pacman,
@@ -794,6 +1052,7 @@ def runGames(
     numTraining=0,
     catchExceptions=False,
     timeout=30,
+    workers=None,
 ):
     import __main__
 
@@ -802,7 +1061,13 @@ def runGames(
     rules = ClassicGameRules(timeout)
     games = []
 
-    for i in range(numGames):
+    # With workers only the training games, which the agent learns from in
+    # order, are played here; the test games go to runParallelGames
+    numSequential = numGames
+    if workers != None:
+        numSequential = min(numGames, numTraining)
+
+    for i in range(numSequential):
         beQuiet = i < numTraining
         if beQuiet:
             # Suppress output and graphics
@@ -821,16 +1086,23 @@ def runGames(
             games.append(game)
 
         if record:
-            import time
-            import _pickle as cPickle
-
-            fname = ("recorded-game-%d" % (i + 1)) + "-".join(
-                [str(t) for t in time.localtime()[1:6]]
-            )
-            f = open(fname, "w")
-            components = {"layout": layout, "actions": game.moveHistory}
-            cPickle.dump(components, f)
-            f.close()
+            recordGame(layout, game.moveHistory, i + 1)
+
+    if numSequential < numGames:
+        parallelGames = runParallelGames(
+            layout,
+            pacman,
+            ghosts,
+            numGames - numSequential,
+            catchExceptions,
+            timeout,
+            workers,
+            numSequential,
+        )
+        for i, game in enumerate(parallelGames):
+            if record:
+                recordGame(layout, game.moveHistory, numSequential + i + 1)
+        games.extend(parallelGames)
 
     if (numGames - numTraining) > 0:
         scores = [game.state.getScore() for game in games]
@@ -840,6 +1112,13 @@ def runGames(
         print("Scores:       ", ", ".join([str(score) for score in scores]))
         print("Win Rate:      %d/%d (%.2f)" % (wins.count(True), len(wins), winRate))
         print("Record:       ", ", ".join([["Loss", "Win"][int(w)] for w in wins]))
+        timeouts = [game.agentTimeout for game in games].count(True)
+        # A timeout also marks the game as crashed: count it only once
+        crashes = [
+            game.agentCrashed and not game.agentTimeout for game in games
+        ].count(True)
+        if timeouts or crashes:
+            print("Timeouts:      %d  Crashes: %d" % (timeouts, crashes))
 
     return games
 
@@ -0,0 +1,66 @@
+import contextlib
+import io
+import random
+import unittest
+
+import layout
+import pacman
+import textDisplay
+from game import Agent
+from ghostAgents import RandomGhost
+
+# Test delle partite giocate in parallelo con pacman.py --workers.
+# Si eseguono dalla cartella reinforcement con:
+#
+#   python -m unittest test_parallelGames
+
+
+class CountingAgent(Agent):
+    """
+    Agente che sceglie le mosse in base alle partite e alle mosse già giocate:
+    se una partita vedesse lo stato lasciato da un'altra, giocherebbe diverso.
+    """
+
+    def __init__(self):
+        self.games = 0
+        self.moves = 0
+
+    def registerInitialState(self, state):
+        self.games += 1
+
+    def getAction(self, state):
+        self.moves += 1
+        legal = state.getLegalPacmanActions()
+        return legal[(self.games * 7 + self.moves) % len(legal)]
+
+
+def play(workers, num_games=4, seed=5):
+    """
+    Gioca le partite di test con il numero di processi indicato e restituisce
+    il punteggio e le mosse di ciascuna.
+    """
+    random.seed(seed)
+    ghosts = [RandomGhost(1), RandomGhost(2)]
+    with contextlib.redirect_stdout(io.StringIO()):
+        games = pacman.runGames(
+            layout.getLayout("smallClassic"),
+            CountingAgent(),
+            ghosts,
+            textDisplay.NullGraphics(),
+            num_games,
+            False,
+            workers=workers,
+        )
+    return [(game.state.getScore(), game.moveHistory) for game in games]
+
+
+class ParallelGamesTest(unittest.TestCase):
+    def test_results_do_not_depend_on_workers(self):
+        results = play(1)
+        self.assertEqual(len(results), 4)
+        for workers in (2, 3, 4):
+            self.assertEqual(play(workers), results)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+import unittest
+
+import layout
+import pacman
+
+# Test delle copie copy-on-write restituite da GameState.snapshot (pacman.py).
+# Si eseguono dalla cartella reinforcement con:
+#
+#   python -m unittest test_snapshot
+
+
+def initial_state(layout_name="mediumClassic", num_ghosts=2):
+    state = pacman.GameState()
+    state.initialize(layout.getLayout(layout_name), num_ghosts)
+    return state
+
+
+class SnapshotTest(unittest.TestCase):
+    def test_food_writes_stay_in_snapshot(self):
+        state = initial_state()
+        food = state.getFood().copy()
+        num_food = state.getNumFood()
+        snapshot = state.snapshot()
+
+        x, y = food.asList()[0]
+        snapshot.getFood()[x][y] = False
+        column = snapshot.getFood()[x + 1]
+        column[y] = True
+
+        self.assertEqual(state.getFood(), food)
+        self.assertEqual(state.getNumFood(), num_food)
+        self.assertFalse(snapshot.hasFood(x, y))
+        self.assertTrue(snapshot.hasFood(x + 1, y))
+
+    def test_ghost_writes_stay_in_snapshot(self):
+        state = initial_state()
+        snapshot = state.snapshot()
+
+        snapshot.getGhostState(1).scaredTimer = 40
+        snapshot.getGhostStates()[1].scaredTimer = 7
+
+        self.assertEqual(snapshot.getGhostState(1).scaredTimer, 40)
+        self.assertEqual(snapshot.getGhostState(2).scaredTimer, 7)
+        self.assertEqual(
+            [ghost.scaredTimer for ghost in state.getGhostStates()], [0, 0]
+        )
+
+    def test_successor_writes_stay_in_successor(self):
+        state = initial_state()
+        food = state.getFood().copy()
+        snapshot = state.snapshot()
+        successor = snapshot.generateSuccessor(0, snapshot.getLegalActions(0)[0])
+
+        for x, y in food.asList():
+            successor.getFood()[x][y] = False
+        successor.getGhostState(1).scaredTimer = 40
+
+        self.assertEqual(state.getFood(), food)
+        self.assertEqual(snapshot.getFood(), food)
+        self.assertEqual(state.getGhostState(1).scaredTimer, 0)
+        self.assertEqual(snapshot.getGhostState(1).scaredTimer, 0)
+
+    def test_snapshot_equals_state(self):
+        state = initial_state()
+        for agent in range(state.getNumAgents()):
+            state = state.generateSuccessor(agent, state.getLegalActions(agent)[0])
+        snapshot = state.snapshot()
+        self.assertEqual(snapshot, state)
+        self.assertEqual(hash(snapshot), hash(state))
+        self.assertEqual(str(snapshot), str(state))
+
+
+if __name__ == "__main__":
+    unittest.main()
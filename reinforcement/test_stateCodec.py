@@ -0,0 +1,148 @@
+import random
+import unittest
+
+import layout
+import pacman
+from game import CODEC_VERSION, Grid, gridFromBytes, reconstituteGrid
+
+# Test di andata e ritorno del formato binario di Grid e GameState (game.py).
+# Si eseguono dalla cartella reinforcement con:
+#
+#   python -m unittest test_stateCodec
+
+
+def random_grid(rng, width, height):
+    grid = Grid(width, height)
+    for x in range(width):
+        for y in range(height):
+            grid[x][y] = rng.random() < 0.5
+    return grid
+
+
+def random_states(layout_name, num_ghosts, seed, num_games=3):
+    """
+    Genera gli stati di alcune partite giocate con mosse casuali.
+    """
+    rng = random.Random(seed)
+    start = pacman.GameState()
+    start.initialize(layout.getLayout(layout_name), num_ghosts)
+    for _ in range(num_games):
+        state = start
+        agent = 0
+        yield state
+        while not (state.isWin() or state.isLose()):
+            state = state.generateSuccessor(
+                agent, rng.choice(state.getLegalActions(agent))
+            )
+            agent = (agent + 1) % state.getNumAgents()
+            yield state
+
+
+class GridCodecTest(unittest.TestCase):
+    def test_pack_bits_round_trip(self):
+        rng = random.Random(0)
+        # 30 celle per intero: anche griglie con un multiplo esatto di celle
+        for width, height in [(1, 1), (3, 10), (5, 6), (7, 7), (28, 31)]:
+            grid = random_grid(rng, width, height)
+            self.assertEqual(reconstituteGrid(grid.packBits()), grid)
+
+    def test_bytes_round_trip(self):
+        rng = random.Random(1)
+        for width, height in [(1, 1), (2, 4), (3, 5), (8, 8), (28, 31), (40, 3)]:
+            grid = random_grid(rng, width, height)
+            decoded = gridFromBytes(grid.toBytes())
+            self.assertEqual((decoded.width, decoded.height), (width, height))
+            self.assertEqual(decoded, grid)
+            self.assertEqual(hash(decoded), hash(grid))
+            self.assertEqual(str(decoded), str(grid))
+            self.assertEqual(len(grid.toBytes()), 5 + (width * height + 7) // 8)
+
+    def test_decoded_grid_is_writable(self):
+        grid = Grid(4, 3)
+        decoded = gridFromBytes(grid.toBytes())
+        hash(decoded)
+        decoded[2][1] = True
+        self.assertEqual(decoded.asList(), [(2, 1)])
+        self.assertNotEqual(hash(decoded), hash(grid))
+
+    def test_rejects_bad_data(self):
+        data = random_grid(random.Random(2), 5, 5).toBytes()
+        self.assertRaises(Exception, gridFromBytes, bytes([CODEC_VERSION + 1]) + data[1:])
+        self.assertRaises(Exception, gridFromBytes, data[:-1])
+        self.assertRaises(Exception, gridFromBytes, data + b"\x00")
+        self.assertRaises(Exception, gridFromBytes, data[:5] + b"\xff" * 4)
+
+
+class StateCodecTest(unittest.TestCase):
+    def assertSameState(self, decoded, state):
+        self.assertEqual(decoded, state)
+        self.assertEqual(hash(decoded), hash(state))
+        self.assertEqual(str(decoded), str(state))
+        self.assertEqual(decoded.getCapsules(), state.getCapsules())
+        self.assertEqual(decoded.isWin(), state.isWin())
+        self.assertEqual(decoded.isLose(), state.isLose())
+        self.assertEqual(decoded.data._eaten, state.data._eaten)
+        self.assertEqual(decoded.data._agentMoved, state.data._agentMoved)
+        self.assertEqual(decoded.data._foodEaten, state.data._foodEaten)
+        self.assertEqual(decoded.data._capsuleEaten, state.data._capsuleEaten)
+        for a, b in zip(decoded.data.agentStates, state.data.agentStates):
+            self.assertEqual(a.isPacman, b.isPacman)
+            self.assertEqual(a.start, b.start)
+            self.assertEqual(a.scaredTimer, b.scaredTimer)
+            self.assertEqual(a.configuration.pos, b.configuration.pos)
+            self.assertEqual(
+                [type(c) for c in a.configuration.pos],
+                [type(c) for c in b.configuration.pos],
+            )
+
+    def test_round_trip(self):
+        for layout_name, num_ghosts in [
+            ("smallGrid", 1),
+            ("mediumClassic", 2),
+            ("originalClassic", 4),
+        ]:
+            states = 0
+            for state in random_states(layout_name, num_ghosts, layout_name):
+                decoded = pacman.GameState.fromBytes(
+                    state.toBytes(), state.data.layout
+                )
+                self.assertSameState(decoded, state)
+                states += 1
+            self.assertGreater(states, 10)
+
+    def test_decoded_state_plays_on(self):
+        for state in random_states("mediumClassic", 2, 3, num_games=1):
+            if state.isWin() or state.isLose():
+                continue
+            decoded = pacman.GameState.fromBytes(state.toBytes(), state.data.layout)
+            agent = state.data._agentMoved
+            agent = 0 if agent is None else (agent + 1) % state.getNumAgents()
+            self.assertEqual(
+                decoded.getLegalActions(agent), state.getLegalActions(agent)
+            )
+            for action in state.getLegalActions(agent):
+                self.assertEqual(
+                    decoded.generateSuccessor(agent, action),
+                    state.generateSuccessor(agent, action),
+                )
+
+    def test_rejects_other_layout(self):
+        state = pacman.GameState()
+        state.initialize(layout.getLayout("smallGrid"), 1)
+        data = state.toBytes()
+        self.assertRaises(
+            Exception,
+            pacman.GameState.fromBytes,
+            data,
+            layout.getLayout("mediumGrid"),
+        )
+        self.assertRaises(
+            Exception,
+            pacman.GameState.fromBytes,
+            bytes([CODEC_VERSION + 1]) + data[1:],
+            state.data.layout,
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -15,6 +15,7 @@
 import sys
 import inspect
 import heapq, random
+import math
 try:
     from StringIO import StringIO ## for Python 2
 except ImportError:
@@ -204,6 +205,79 @@ class PriorityQueueWithFunction(PriorityQueue):
         "Adds an item to the queue with priority from the priority function"
         PriorityQueue.push(self, item, self.priorityFunction(item))
 
+_MASK64 = (1 << 64) - 1
+
+def mixHash(value):
+    """
+    Spreads the bits of a hash over 64 bits (the splitmix64 finalizer), so
+    that hashes of similar items, such as small ints, look random.
+    """
+    value &= _MASK64
+    value = ((value ^ (value >> 30)) * 0xbf58476d1ce4e5b9) & _MASK64
+    value = ((value ^ (value >> 27)) * 0x94d049bb133111eb) & _MASK64
+    return value ^ (value >> 31)
+
+class HyperLogLog:
+    """
+      Estimates how many distinct items were added, in constant memory:
+      2**precision one-byte registers.  The standard error of the estimate is
+      about 1.04 / sqrt(2**precision), i.e. 1.6% with the default precision.
+
+      Items are identified by their hash, so equal items count once.
+    """
+    def __init__(self, precision=12):
+        if not 4 <= precision <= 16:
+            raise Exception("HyperLogLog precision must be between 4 and 16")
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    def add(self, item):
+        h = mixHash(hash(item))
+        bits = 64 - self.precision
+        index = h >> bits
+        # One more than the number of leading zeros in the remaining bits
+        rank = bits - (h & ((1 << bits) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def count(self):
+        "Returns the estimated number of distinct items"
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum([2.0 ** -r for r in self.registers])
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # Few items: linear counting is more accurate
+            estimate = m * math.log(float(m) / zeros)
+        return int(round(estimate))
+
+    def merge(self, other):
+        "Adds the items counted by other, which must have the same precision"
+        if other.precision != self.precision:
+            raise Exception("Cannot merge HyperLogLogs of different precision")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+class ReservoirSample:
+    """
+      A uniform random sample of at most size of the items added so far
+      (reservoir sampling).  It uses its own random generator, so sampling
+      does not change the sequence of the random module.
+    """
+    def __init__(self, size, seed=None):
+        self.size = size
+        self.seen = 0
+        self.items = []
+        self.random = random.Random(seed)
+
+    def add(self, item):
+        self.seen += 1
+        if len(self.items) < self.size:
+            self.items.append(item)
+        else:
+            slot = self.random.randrange(self.seen)
+            if slot < self.size:
+                self.items[slot] = item
+
 
 def manhattanDistance( xy1, xy2 ):
     "Returns the Manhattan distance between points xy1 and xy2"
@@ -625,6 +699,87 @@ class TimeoutFunction:
         return result
 
 
+# Deadline-based timeouts, for Game.run.
+#
+# Unlike TimeoutFunction these work in any thread, with sub-second
+# timeouts, and any number can be active at once, so several games can
+# run in parallel threads each with its own limits.  A function that
+# overruns is not interrupted: it can notice the overrun with
+# checkDeadline(), and DeadlineFunction raises TimeoutFunctionException
+# when it returns.
+import threading
+
+
+class Deadline:
+    """
+    A point in time (on the time.monotonic clock) by which some work should be
+    done.  Once the time is up, the expired flag stays set.
+    """
+
+    def __init__(self, timeout):
+        self.end = time.monotonic() + timeout
+        self.expired = False
+
+    def remaining(self):
+        "Seconds left, or 0 if the deadline has passed"
+        return max(0.0, self.end - time.monotonic())
+
+    def isExpired(self):
+        if not self.expired and time.monotonic() >= self.end:
+            self.expired = True
+        return self.expired
+
+    def check(self):
+        "Raises TimeoutFunctionException if the deadline has passed"
+        if self.isExpired():
+            raise TimeoutFunctionException()
+
+
+_CURRENT_DEADLINE = threading.local()
+
+
+def currentDeadline():
+    """
+    Returns the Deadline of the DeadlineFunction running in this thread, or
+    None.  Agents can use it to plan their work, e.g. with remaining().
+    """
+    return getattr(_CURRENT_DEADLINE, "deadline", None)
+
+
+def checkDeadline():
+    """
+    Raises TimeoutFunctionException if the DeadlineFunction running in this
+    thread has run out of time.  Agents can call it in long loops to give up
+    as soon as the time is up.
+    """
+    deadline = currentDeadline()
+    if deadline != None:
+        deadline.check()
+
+
+class DeadlineFunction:
+    """
+    A drop-in replacement for TimeoutFunction built on Deadline: calling it
+    calls function, and raises TimeoutFunctionException if the call took
+    timeout seconds (a float) or more.
+    """
+
+    def __init__(self, function, timeout):
+        self.timeout = timeout
+        self.function = function
+
+    def __call__(self, *args, **keyArgs):
+        deadline = Deadline(self.timeout)
+        previous = currentDeadline()
+        _CURRENT_DEADLINE.deadline = deadline
+        try:
+            result = self.function(*args, **keyArgs)
+        finally:
+            _CURRENT_DEADLINE.deadline = previous
+        deadline.check()
+        return result
+
+
 
 _ORIGINAL_STDOUT = None
 _ORIGINAL_STDERR = None